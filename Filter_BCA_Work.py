@@ -1,22 +1,104 @@
 import pandas as pd
 import streamlit as st
-import re
 import io
 import os
 import base64
+import functools
+import hashlib
+import math
 import time
-import folium
-from geopy.geocoders import Nominatim
-from geopy.exc import GeocoderTimedOut
-from concurrent.futures import ThreadPoolExecutor, as_completed
-from streamlit_folium import st_folium
+import uuid
+import numpy as np
+from filter_index import FilterIndex, sort_positions
+from geocode_store import GeocodeStore, normalize_postcode
+from geocode_service import GeocodeService
+from geocoding import TokenBucket, nominatim_geocode
+from job_map import MAP_MODES, create_folium_map
+from job_pipeline import (
+    CHUNKED_CSV_BYTES, EXPORT_FORMATS, UPLOAD_TYPES, enrich_jobs_incremental, export_jobs, ingest_csv_chunked,
+    read_jobs_cached,
+)
+from pipeline_metrics import PipelineMetrics, collecting, current_metrics, stage
+from postcode_centroids import DEFAULT_CENTROIDS_PATH, load_centroid_geocoder
+from spatial_index import SpatialIndex
 
 
 st.set_page_config(layout="wide")  # Enable wide mode for the app
 
-st.markdown(
-    """
+
+def get_image_as_base64(image_path):
+    with open(image_path, "rb") as image_file:
+        return base64.b64encode(image_file.read()).decode("utf-8")
+
+
+# Custom CSS for scrollbar and layout
+HEADER_CSS = """
     <style>
+    /* Custom scrollbar for all scrollable content */
+    ::-webkit-scrollbar {
+        width: 15px; /* Width of the vertical scrollbar */
+        height: 15px; /* Height of the horizontal scrollbar */
+    }
+
+    /* Scrollbar track */
+    ::-webkit-scrollbar-track {
+        background: #555; /* Light grey background for the track */
+    }
+
+    /* Scrollbar thumb (the draggable handle) */
+    ::-webkit-scrollbar-thumb {
+        background: #555; /* Default color of the scrollbar thumb */
+        border-radius: 10px; /* Rounded corners */
+        border: 3px solid #e0e0e0; /* Add a border to make it distinct */
+    }
+
+    /* Scrollbar thumb hover (when the mouse hovers over the thumb) */
+    ::-webkit-scrollbar-thumb:hover {
+        background: #555 !important; /* Dark grey for better visibility when hovered */
+        border: 3px solid #e0e0e0; /* Maintain the border color */
+    }
+
+    /* Scrollbar thumb active (when clicked or dragged) */
+    ::-webkit-scrollbar-thumb:active {
+        background: #333 !important; /* Even darker grey when actively dragging */
+        border: 3px solid #e0e0e0; /* Maintain the border color */
+    }
+
+    /* Scrollbar corner (intersection of horizontal and vertical scrollbars) */
+    ::-webkit-scrollbar-corner {
+        background: #e0e0e0; /* Matches the track color */
+    }
+
+    /* Custom image alignment section */
+    .image-container {
+        display: flex;
+        justify-content: space-between; /* Adjust spacing between images */
+        align-items: center;
+        margin-bottom: 20px; /* Add space below the images */
+        position: relative;
+    }
+
+    /* Individual image positions */
+    .bca-img {
+        flex-grow: 0 !important; /* Prevent growing */
+        flex-shrink: 0 !important; /* Prevent shrinking */
+        margin-left: 600px !important;
+        width: 275px !important;
+        height: 125px !important; /* Explicitly define size */
+    }
+    .x-img {
+        flex-grow: 0 !important; /* Prevent growing */
+        flex-shrink: 0 !important; /* Prevent shrinking */
+        width: 95px !important; /* Explicitly define size */
+        height: 95px !important; /* Explicitly define size */
+    }
+    .cmg-img {
+        flex-grow: 0 !important; /* Prevent growing */
+        flex-shrink: 0 !important; /* Prevent shrinking */
+        margin-right:600px !important;
+        width: 315px !important; /* Explicitly define size */
+        height: 145px !important; /* Explicitly define size */
+    }
     .center-content {
         display: flex;
         flex-direction: column;
@@ -28,423 +110,347 @@ st.markdown(
         width: 80%; /* Adjust width as needed */
     }
     </style>
-    """,
-    unsafe_allow_html=True
-)
+"""
 
-def debug_map_state(event):
-    print(f"{event}:")
-    print(f" - st.session_state['map_center']: {st.session_state.get('map_center')}")
-    print(f" - st.session_state['map_zoom']: {st.session_state.get('map_zoom')}")
 
+# Header logos
+HEADER_IMAGES = [
+    ("images/BCA_New.png", "BCA", "bca-img"),
+    ("images/X_New.png", "X", "x-img"),
+    ("images/CMG_New.png", "CMG", "cmg-img"),
+]
+
+
+# Header CSS and base64-encoded logos, read from disk once per process
+@st.cache_resource
+def get_header_html():
+    images = "\n".join(
+        f'        <img src="data:image/png;base64,{get_image_as_base64(path)}" alt="{alt}" class="{css_class}">'
+        for path, alt, css_class in HEADER_IMAGES
+    )
+    return f"""{HEADER_CSS}
+    <div class="image-container">
+{images}
+    </div>
+    """
+
+
+# Table pagination
+PAGE_SIZES = [50, 100, 250, 500, 1000]
+FILE_ORDER = "(file order)"
+
+
+# Shared on-disk geocode store (one per process, reused across sessions)
+@st.cache_resource
+def get_geocode_store():
+    return GeocodeStore()
+
+
+# Offline postcode-centroid geocoder (loaded once per process, None if no dataset installed)
+@st.cache_resource
+def get_centroid_geocoder():
+    return load_centroid_geocoder()
+
+
+# Process-wide geocoding queue: one rate limit for every session, and a postcode
+# already being looked up for one session is shared with the others
+@st.cache_resource
+def get_geocode_service():
+    return GeocodeService(nominatim_geocode, TokenBucket())
 
-def get_image_as_base64(image_path):
-    with open(image_path, "rb") as image_file:
-        return base64.b64encode(image_file.read()).decode("utf-8")
-    
 
 # Function to geocode postcodes
 @st.cache_data(show_spinner=True)
 def geocode_postcode(postcode):
-    # Initialize geolocator
-    geolocator = Nominatim(user_agent="streamlit_geocoder", timeout=10)
+    # Answer from the local centroid dataset when possible
+    centroid_geocoder = get_centroid_geocoder()
+    if centroid_geocoder is not None:
+        lat, lon = centroid_geocoder.geocode(postcode)
+        if lat is not None:
+            return lat, lon
+
+    # Fall back to Nominatim through the shared queue, ahead of bulk upload lookups
+    return get_geocode_service().geocode(postcode)
+
+
+def find_postcode(postcode):
+    """
+    geocode_postcode, with lookup errors (timeouts, provider outages) reported
+    as not found. Errors are caught outside the cached function so they aren't
+    cached, and the next rerun tries again.
+    """
     try:
-        location = geolocator.geocode(postcode)
-        if location:
-            return location.latitude, location.longitude
-    except GeocoderTimedOut:
-        time.sleep(1)
-        return geocode_postcode(postcode)  # Retry on timeout
-    return None, None
-
-# Function to geocode postcodes in parallel
-def parallel_geocode(postcodes):
-    results = []
-    with ThreadPoolExecutor(max_workers=10) as executor:  # Adjust workers for performance
-        future_to_postcode = {executor.submit(geocode_postcode, postcode): postcode for postcode in postcodes}
-        for future in as_completed(future_to_postcode):
-            postcode = future_to_postcode[future]
-            try:
-                results.append((postcode, future.result()))
-            except Exception as e:
-                st.warning(f"Failed to geocode {postcode}: {e}")
-                results.append((postcode, (None, None)))
-    return results
-
-# Function to process geocoding for the dataset with progress bar
-@st.cache_data(show_spinner=False)
-def process_geocoding(data):
-    # Deduplicate postcodes to minimize requests
-    unique_postcodes = pd.concat([data['CollPostCode'], data['DelPostCode']]).dropna().unique()
-    total_postcodes = len(unique_postcodes)
-
-    # Initialize progress bar
-    progress_bar = st.progress(0)
-
-    # Placeholder for results
-    geocoded_results = []
-
-    # Geocode postcodes with progress updates
-    for idx, postcode in enumerate(unique_postcodes):
-        # Perform geocoding (replace this with the actual geocoding logic)
-        lat, lon = geocode_postcode(postcode)  # Replace `geocode_postcode` with your actual geocoding function
-        geocoded_results.append((postcode, (lat, lon)))
-
-        # Update progress bar
-        progress_bar.progress(int(((idx + 1) / total_postcodes) * 100))
-
-    # Map geocoding results to a dictionary
-    geocode_dict = {postcode: coords for postcode, coords in geocoded_results}
-
-    # Add latitude and longitude columns to the dataset
-    data['CollLat'] = data['CollPostCode'].map(lambda x: geocode_dict.get(x, (None, None))[0])
-    data['CollLon'] = data['CollPostCode'].map(lambda x: geocode_dict.get(x, (None, None))[1])
-    data['DelLat'] = data['DelPostCode'].map(lambda x: geocode_dict.get(x, (None, None))[0])
-    data['DelLon'] = data['DelPostCode'].map(lambda x: geocode_dict.get(x, (None, None))[1])
-
-    # Replace missing latitude/longitude with "N/A"
-    data.fillna({"CollLat": "N/A", "CollLon": "N/A", "DelLat": "N/A", "DelLon": "N/A"}, inplace=True)
-
-    return data
-
-
-def create_folium_map(data):
+        return geocode_postcode(postcode)
+    except Exception:
+        return None, None
+
+
+@st.cache_data(show_spinner=False, max_entries=8)
+def load_enriched_jobs(file_hash, file_name, _file_bytes, _previous=None, _session_id=None):
     """
-    Generate a Folium map with markers for collection and delivery points.
-    Combines markers with the same location into a single marker and adds job count.
+    Read, clean, geocode and region-tag an upload.
+    Cached on the hash of the uploaded bytes, so widget reruns skip straight to filtering.
+
+    `_previous` is the (data, rows) snapshot of the last upload in this session;
+    when given, only rows that are new or changed since then are processed.
+    Network lookups share the geocode service fairly with other sessions as `_session_id`.
+    Returns (data, geocode_report, rows), rows being None for chunked CSVs.
     """
-    # Define a default center and zoom for the map
-    map_center = [data["CollLat"].mean(), data["CollLon"].mean()]
-    map_zoom = 9
-
-    # Create the map
-    folium_map = folium.Map(location=map_center, zoom_start=map_zoom)
-
-    # Group collection points by location
-    coll_grouped = data.groupby(["CollLat", "CollLon"])["JobNumber"].apply(list).reset_index()
-    for _, row in coll_grouped.iterrows():
-        if row["CollLat"] != "N/A" and row["CollLon"] != "N/A":
-            job_numbers = row["JobNumber"]
-            job_count = len(job_numbers)
-            job_list = ", ".join(job_numbers)
-            popup_content = f"""
-                <b>Total Jobs:</b> {job_count}<br>
-                <b>Job Numbers:</b> {job_list}<br>
-                <b>Type:</b> Collection
-            """
-            folium.Marker(
-                location=[row["CollLat"], row["CollLon"]],
-                popup=popup_content,
-                tooltip=f"Collection Point - {job_count} Jobs",
-                icon=folium.Icon(color="blue", icon="info-sign"),
-            ).add_to(folium_map)
-
-    # Group delivery points by location
-    del_grouped = data.groupby(["DelLat", "DelLon"])["JobNumber"].apply(list).reset_index()
-    for _, row in del_grouped.iterrows():
-        if row["DelLat"] != "N/A" and row["DelLon"] != "N/A":
-            job_numbers = row["JobNumber"]
-            job_count = len(job_numbers)
-            job_list = ", ".join(job_numbers)
-            popup_content = f"""
-                <b>Total Jobs:</b> {job_count}<br>
-                <b>Job Numbers:</b> {job_list}<br>
-                <b>Type:</b> Delivery
-            """
-            folium.Marker(
-                location=[row["DelLat"], row["DelLon"]],
-                popup=popup_content,
-                tooltip=f"Delivery Point - {job_count} Jobs",
-                icon=folium.Icon(color="green", icon="flag"),
-            ).add_to(folium_map)
-
-    return folium_map
-    
-def main():
-    
-    # Paths to images
-    x_image_path = "images/X_New.png"
-    bca_image_path = "images/BCA_New.png"
-    cmg_image_path = "images/CMG_New.png"
-
-    # Convert images to Base64
-    x_image_base64 = get_image_as_base64(x_image_path)
-    bca_image_base64 = get_image_as_base64(bca_image_path)
-    cmg_image_base64 = get_image_as_base64(cmg_image_path)
-
-    # Inject custom CSS for scrollbar and layout
-    st.markdown(
-        f"""
-        <style>
-        /* Custom scrollbar for all scrollable content */
-        ::-webkit-scrollbar {{
-            width: 15px; /* Width of the vertical scrollbar */
-            height: 15px; /* Height of the horizontal scrollbar */
-        }}
-
-        /* Scrollbar track */
-        ::-webkit-scrollbar-track {{
-            background: #555; /* Light grey background for the track */
-        }}
-
-        /* Scrollbar thumb (the draggable handle) */
-        ::-webkit-scrollbar-thumb {{
-            background: #555; /* Default color of the scrollbar thumb */
-            border-radius: 10px; /* Rounded corners */
-            border: 3px solid #e0e0e0; /* Add a border to make it distinct */
-        }}
-
-        /* Scrollbar thumb hover (when the mouse hovers over the thumb) */
-        ::-webkit-scrollbar-thumb:hover {{
-            background: #555 !important; /* Dark grey for better visibility when hovered */
-            border: 3px solid #e0e0e0; /* Maintain the border color */
-        }}
-
-        /* Scrollbar thumb active (when clicked or dragged) */
-        ::-webkit-scrollbar-thumb:active {{
-            background: #333 !important; /* Even darker grey when actively dragging */
-            border: 3px solid #e0e0e0; /* Maintain the border color */
-        }}
-
-        /* Scrollbar corner (intersection of horizontal and vertical scrollbars) */
-        ::-webkit-scrollbar-corner {{
-            background: #e0e0e0; /* Matches the track color */
-        }}
-
-        /* Custom image alignment section */
-        .image-container {{
-            display: flex;
-            justify-content: space-between; /* Adjust spacing between images */
-            align-items: center;
-            margin-bottom: 20px; /* Add space below the images */
-            position: relative;
-        }}
-
-        /* Individual image positions */
-        .bca-img {{
-            flex-grow: 0 !important; /* Prevent growing */
-            flex-shrink: 0 !important; /* Prevent shrinking */
-            margin-left: 600px !important;
-            width: 275px !important;
-            height: 125px !important; /* Explicitly define size */
-        }}
-        .x-img {{
-            flex-grow: 0 !important; /* Prevent growing */
-            flex-shrink: 0 !important; /* Prevent shrinking */
-            width: 95px !important; /* Explicitly define size */
-            height: 95px !important; /* Explicitly define size */
-        }}
-        .cmg-img {{
-            flex-grow: 0 !important; /* Prevent growing */
-            flex-shrink: 0 !important; /* Prevent shrinking */
-            margin-right:600px !important;
-            width: 315px !important; /* Explicitly define size */
-            height: 145px !important; /* Explicitly define size */
-        }}
-        </style>
-        """,
-        unsafe_allow_html=True,
+    service = get_geocode_service().for_caller(_session_id)
+    with st.spinner("Geocoding postcodes... This may take some time."):
+        # Initialize progress bar and timer display
+        progress_bar = st.progress(0)
+        timer_placeholder = st.empty()
+        start_time = time.time()
+
+        def show_progress(done, total):
+            # Calculate progress and update progress bar
+            progress_bar.progress(int(done / total * 100))
+
+            # Estimate remaining time from the observed completion rate
+            elapsed_time = time.time() - start_time
+            remaining_time = elapsed_time / done * (total - done)
+            timer_placeholder.write(f"Estimated time remaining: {remaining_time:.2f} seconds")
+
+        if file_name.endswith('.csv') and len(_file_bytes) >= CHUNKED_CSV_BYTES:
+            # Large exports: read only the job columns in chunks, geocoding while reading
+            data, geocode_report = ingest_csv_chunked(
+                io.BytesIO(_file_bytes),
+                service.rate_limiter,
+                centroid_geocoder=get_centroid_geocoder(),
+                store=get_geocode_store(),
+                on_progress=show_progress,
+                service=service,
+            )
+            rows = None
+        else:
+            data, geocode_report, rows = enrich_jobs_incremental(
+                read_jobs_cached(_file_bytes, file_name, file_hash),
+                _previous,
+                service.rate_limiter,
+                centroid_geocoder=get_centroid_geocoder(),
+                store=get_geocode_store(),
+                on_progress=show_progress,
+                service=service,
+            )
+
+        progress_bar.empty()
+        timer_placeholder.empty()
+
+    return data, geocode_report, rows
+
+
+# Filter index built once per uploaded dataset
+@st.cache_resource(max_entries=8)
+def get_filter_index(file_hash, _data):
+    return FilterIndex(_data)
+
+
+# Collection and delivery spatial indexes built once per uploaded dataset
+@st.cache_resource(max_entries=8)
+def get_spatial_indexes(file_hash, _data):
+    return {prefix: SpatialIndex(_data[f'{prefix}Lat'], _data[f'{prefix}Lon']) for prefix in ('Coll', 'Del')}
+
+
+# Sort order of the whole dataset per column, reused for any filtered view
+@st.cache_resource(max_entries=32)
+def get_sort_order(file_hash, column, ascending, _data):
+    return sort_positions(_data, column, ascending)
+
+
+def show_paginated_table(data, mask, key, height):
+    """
+    Show the rows of `data` selected by `mask` one page at a time.
+    Sorting uses a cached whole-dataset order, so only the visible page is
+    copied and sent to the browser.
+    """
+    controls = st.columns(4)
+    sort_column = controls[0].selectbox("Sort by", [FILE_ORDER, *data.columns], key=f"{key}_sort")
+    descending = controls[1].selectbox("Order", ["Ascending", "Descending"], key=f"{key}_order") == "Descending"
+    page_size = controls[2].selectbox("Rows per page", PAGE_SIZES, index=1, key=f"{key}_page_size")
+
+    if sort_column == FILE_ORDER:
+        positions = np.flatnonzero(mask)
+    else:
+        order = get_sort_order(st.session_state["upload_hash"], sort_column, not descending, data)
+        positions = order[mask[order]]
+
+    # The page widget is keyed on the page count so it resets when the result size changes
+    total_rows = len(positions)
+    page_count = max(1, -(-total_rows // page_size))
+    page = controls[3].number_input(
+        f"Page (of {page_count:,})", min_value=1, max_value=page_count, value=1, step=1,
+        key=f"{key}_page_{page_count}",
     )
 
-    # HTML for displaying images
-    image_html = f"""
-    <div class="image-container">
-        <img src="data:image/png;base64,{bca_image_base64}" alt="BCA" class="bca-img">
-        <img src="data:image/png;base64,{x_image_base64}" alt="X" class="x-img">
-        <img src="data:image/png;base64,{cmg_image_base64}" alt="CMG" class="cmg-img">
-    </div>
+    start = (page - 1) * page_size
+    page_positions = positions[start:start + page_size]
+    st.caption(
+        f"Showing rows {start + 1 if total_rows else 0:,}-{start + len(page_positions):,} "
+        f"of {total_rows:,} jobs ({len(data):,} in file)"
+    )
+    st.dataframe(data.iloc[page_positions], width=1800, height=height)
+
+
+def get_session_map(file_hash, filter_mask, map_mode, data):
+    """
+    Return this session's map, rebuilding it only when the filtered row set
+    (fingerprinted from the filter mask) or the render mode changes.
     """
+    fingerprint = hashlib.sha1(
+        file_hash.encode() + map_mode.encode() + np.packbits(filter_mask).tobytes()
+    ).hexdigest()
+    cached = st.session_state.get("folium_map")
+    if cached is None or cached[0] != fingerprint:
+        with stage("map build", rows_in=len(data)):
+            cached = (fingerprint, create_folium_map(data, mode=map_mode))
+        st.session_state["folium_map"] = cached
+    return cached[1]
+
+
+def show_stage_metrics(metrics):
+    """Debug panel: stage timings of this rerun and of the last upload processed in this session."""
+    if not st.sidebar.checkbox("Show pipeline timings", value=False):
+        return
+    for title, stages in (
+        ("Last upload processing", st.session_state.get("load_stages")),
+        ("This rerun", metrics.stages),
+    ):
+        if not stages:
+            continue
+        # Stages repeated per chunk are summed into one row
+        summary = pd.DataFrame(stages).groupby("stage", sort=False).agg(
+            seconds=("seconds", "sum"),
+            rows_in=("rows_in", lambda rows: rows.sum(min_count=1)),
+            rows_out=("rows_out", lambda rows: rows.sum(min_count=1)),
+            rss_delta_mb=("rss_delta_mb", lambda change: change.sum(min_count=1)),
+        )
+        st.sidebar.caption(title)
+        st.sidebar.dataframe(summary, width="stretch")
+
+
+def main():
+    # Time this rerun's pipeline stages for the debug panel and the metrics log
+    metrics = PipelineMetrics(session=st.session_state.setdefault("metrics_session", uuid.uuid4().hex[:12]))
+    try:
+        with collecting(metrics):
+            show_app()
+        show_stage_metrics(metrics)
+    finally:
+        metrics.context["upload"] = st.session_state.get("upload_hash", "")[:12]
+        metrics.write()
 
-    # Inject the image HTML into the Streamlit app
-    st.markdown(image_html, unsafe_allow_html=True)
+
+def show_app():
+    
+    # Logos and custom CSS (built once per process)
+    st.markdown(get_header_html(), unsafe_allow_html=True)
 
     st.title("BCA Filtering Tool")
     
-    uploaded_file = st.file_uploader("Upload your Excel or CSV file", type=["xlsx", "csv"])
+    uploaded_file = st.file_uploader("Upload your Excel, CSV, Parquet or Arrow file", type=UPLOAD_TYPES)
     if uploaded_file:
-        # Read the file
-        if uploaded_file.name.endswith('.xlsx'):
-            data = pd.read_excel(uploaded_file)
-        else:
-            data = pd.read_csv(uploaded_file)
-
-        # Fix mixed-type columns
-        for column in data.columns:
-            if data[column].dtype == 'object':  # Mixed-type columns are usually 'object'
-                data[column] = data[column].astype(str)  # Convert everything to string
-
-        # **Fix Comma Handling in Columns (e.g., JobNumber)**
-        data['JobNumber'] = data['JobNumber'].astype(str).str.replace(',', '')   # Remove commas from numbers
-        if 'CustRef3' in data.columns:
-            # Convert the column to string to handle mixed types
-            data['CustRef3'] = data['CustRef3'].astype(str)
-            data['CustRef3'] = data['CustRef3'].replace({'nan': 'N/A', 'None': 'N/A', '': 'N/A'}).fillna('N/A')
-
-        # **Fix Date Columns (Optional)**
-        date_columns = ['StartDate', 'EndDate', 'AgreedDate']
-        for col in date_columns:
-            if col in data.columns:
-                data[col] = pd.to_datetime(data[col], errors='coerce').dt.strftime('%d/%m/%Y')
-
-        # Clean and standardize postcodes
-        data['CollPostCode'] = data['CollPostCode'].str.strip().str.upper()
-        data['DelPostCode'] = data['DelPostCode'].str.strip().str.upper()
-
-        with st.spinner("Geocoding postcodes... This may take some time."):
-            # Deduplicate postcodes to minimize requests
-            unique_postcodes = pd.concat([data['CollPostCode'], data['DelPostCode']]).dropna().unique()
-            total_postcodes = len(unique_postcodes)
-
-            # Initialize progress bar and timer display
-            progress_bar = st.progress(0)
-            timer_placeholder = st.empty()
-
-            # Placeholder for geocoded results
-            geocoded_results = []
-
-            # Start timing
-            start_time = time.time()
-
-            # Geocode postcodes with progress updates
-            for idx, postcode in enumerate(unique_postcodes):
-                # Start timing for this iteration
-                iteration_start_time = time.time()
-
-                # Simulate geocoding (replace this with your geocoding logic)
-                lat, lon = geocode_postcode(postcode)  # Replace with your actual geocoding function
-                geocoded_results.append((postcode, (lat, lon)))
-
-                # Calculate progress and update progress bar
-                progress = int(((idx + 1) / total_postcodes) * 100)
-                progress_bar.progress(progress)
-
-                # Calculate average time per postcode dynamically
-                elapsed_time = time.time() - start_time
-                avg_time_per_postcode = elapsed_time / (idx + 1)
-
-                # Estimate total and remaining time
-                estimated_total_time = avg_time_per_postcode * total_postcodes
-                remaining_time = estimated_total_time - elapsed_time
-
-                # Update timer display dynamically
-                timer_placeholder.write(f"Estimated time remaining: {remaining_time:.2f} seconds")
-
-            # Map geocoding results to a dictionary
-            geocode_dict = {postcode: coords for postcode, coords in geocoded_results}
-
-            # Add latitude and longitude columns to the dataset
-            data['CollLat'] = data['CollPostCode'].map(lambda x: geocode_dict.get(x, (None, None))[0])
-            data['CollLon'] = data['CollPostCode'].map(lambda x: geocode_dict.get(x, (None, None))[1])
-            data['DelLat'] = data['DelPostCode'].map(lambda x: geocode_dict.get(x, (None, None))[0])
-            data['DelLon'] = data['DelPostCode'].map(lambda x: geocode_dict.get(x, (None, None))[1])
-        
-        progress_bar.empty()
-        timer_placeholder.empty()
+        # Hash the upload once per file so reruns reuse the cached ingestion stage
+        if st.session_state.get("upload_file_id") != uploaded_file.file_id:
+            st.session_state["upload_file_id"] = uploaded_file.file_id
+            st.session_state["upload_hash"] = hashlib.sha256(uploaded_file.getvalue()).hexdigest()
+            # A new file starts from the map's default view
+            st.session_state.pop("map_center", None)
+            st.session_state.pop("map_zoom", None)
+
+        incremental = st.checkbox(
+            "Only process jobs that are new or changed since the last upload", value=True,
+            help="Rows are matched on JobNumber; unchanged rows are reused from the previous upload.",
+        )
+        previous = st.session_state.get("job_snapshot") if incremental else None
+        metrics = current_metrics()
+        first_stage = len(metrics.stages) if metrics else 0
+        with stage("load upload") as record:
+            data, geocode_report, rows = load_enriched_jobs(
+                st.session_state["upload_hash"], uploaded_file.name, uploaded_file.getvalue(), previous,
+                st.session_state.get("metrics_session"),
+            )
+            record["rows_out"] = len(data)
+        # Keep the stages of an actual (uncached) load for the timings panel
+        if metrics and len(metrics.stages) > first_stage + 1:
+            st.session_state["load_stages"] = metrics.stages[first_stage:]
+        # Remember this upload as the base for the next incremental refresh
+        if st.session_state.get("snapshot_hash") != st.session_state["upload_hash"]:
+            st.session_state["snapshot_hash"] = st.session_state["upload_hash"]
+            st.session_state["job_snapshot"] = None if rows is None else (data, rows)
+
+        if geocode_report.get("reused_rows"):
+            st.caption(
+                f"Incremental refresh: {geocode_report['processed_rows']} new or changed jobs processed, "
+                f"{geocode_report['reused_rows']} reused from the previous upload"
+            )
+
+        geocode_stats = get_geocode_store().stats()
+        sources = [
+            (geocode_report["previous"], "from the previous upload"),
+            (geocode_report["offline"], "from the offline dataset"),
+            (geocode_report["stored"], "from the geocode store"),
+            (len(geocode_report["fetched"]) + len(geocode_report["failed"]), "looked up online"),
+        ]
+        st.caption(
+            "Postcodes: " + (", ".join(f"{count} {source}" for count, source in sources if count) or "none")
+            + f" (geocode store hit ratio {geocode_stats['hit_ratio']:.0%} since start-up)"
+        )
+        if get_centroid_geocoder() is None:
+            st.info(
+                f"No offline postcode dataset at {DEFAULT_CENTROIDS_PATH}, so every new postcode is looked up "
+                "online (about one a second). Build one with build_postcode_centroids.py."
+            )
+        unreadable_dates = {column: count for column, count in geocode_report["unreadable_dates"].items() if count}
+        if unreadable_dates:
+            st.warning(
+                "Some dates could not be read and were left blank: "
+                + ", ".join(f"{count} in {column}" for column, count in unreadable_dates.items())
+            )
+        if geocode_report["failed"]:
+            failed_postcodes = geocode_report["failed"]
+            st.warning(f"Failed to geocode {len(failed_postcodes)} postcodes: {', '.join(failed_postcodes[:20])}")
 
         # Ensure the geocoded data is valid
         if data[['CollLat', 'CollLon', 'DelLat', 'DelLon']].isna().all().all():
             st.error("No valid geolocation data found. Please check your file.")
 
-        # Function to extract letters before the first number
-        def extract_outward_code(postcode):
-            # Match letters before the first number
-            match = re.match(r"([A-Z]+)", postcode)
-            if match:
-                return match.group(1)  # Extract letters before the first number
-            return None
-
-        # Extract outward codes for collection and delivery postcodes
-        data['CollOutwardCode'] = data['CollPostCode'].apply(extract_outward_code)
-        data['DelOutwardCode'] = data['DelPostCode'].apply(extract_outward_code)
-        # **Map Postcodes to Regions**
-        postcode_to_region = {
-            # Scotland
-            "AB": "Scotland", "DD": "Scotland", "KW": "Scotland", "DG": "Scotland", "KY": "Scotland",
-            "EH": "Scotland", "ML": "Scotland", "FK": "Scotland", "PA": "Scotland", "G": "Scotland",
-            "PH": "Scotland", "TD": "Scotland", "IV": "Scotland",
-            
-            # Northern Ireland
-            "BT": "Northern Ireland",
-            
-            # North East
-            "DH": "North East", "NE": "North East", "DL": "North East", "SR": "North East",
-            "HG": "North East", "TS": "North East", "HU": "North East", "WF": "North East",
-            "LS": "North East", "YO": "North East",
-            
-            # North West
-            "BB": "North West", "L": "North West", "BD": "North West", "LA": "North West",
-            "BL": "North West", "M": "North West", "CA": "North West", "OL": "North West",
-            "CH": "North West", "PR": "North West", "CW": "North West", "SK": "North West",
-            "FY": "North West", "WA": "North West", "HD": "North West", "WN": "North West",
-            "HX": "North West",
-            
-            # East Midlands
-            "CB": "East Midlands", "LN": "East Midlands", "CO": "East Midlands", "NG": "East Midlands",
-            "DE": "East Midlands", "NR": "East Midlands", "DN": "East Midlands", "PE": "East Midlands",
-            "IP": "East Midlands", "S": "East Midlands", "LE": "East Midlands", "SS": "East Midlands",
-            
-            # West Midlands
-            "B": "West Midlands", "ST": "West Midlands", "CV": "West Midlands", "TF": "West Midlands",
-            "DY": "West Midlands", "WR": "West Midlands", "HR": "West Midlands", "WS": "West Midlands",
-            "NN": "West Midlands", "WV": "West Midlands",
-            
-            # Wales
-            "CF": "Wales", "NP": "Wales", "LD": "Wales", "SA": "Wales", "LL": "Wales", "SY": "Wales",
-            
-            # South West
-            "BA": "South West", "PL": "South West", "BH": "South West", "SN": "South West",
-            "BS": "South West", "SP": "South West", "DT": "South West", "TA": "South West",
-            "EX": "South West", "TQ": "South West", "TR": "South West", "GL": "South West",
-            
-            # South East
-            "AL": "South East", "OX": "South East", "BN": "South East", "PO": "South East",
-            "CM": "South East", "RG": "South East", "CT": "South East", "RH": "South East",
-            "GU": "South East", "SG": "South East", "HP": "South East", "SL": "South East",
-            "LU": "South East", "SO": "South East", "ME": "South East", "SS": "South East",
-            "MK": "South East", "TN": "South East",
-            
-            # Greater London
-            "BR": "Greater London", "NW": "Greater London", "CR": "Greater London", "RM": "Greater London",
-            "DA": "Greater London", "SE": "Greater London", "SM": "Greater London", "EC": "Greater London",
-            "SW": "Greater London", "EN": "Greater London", "TW": "Greater London", "HA": "Greater London",
-            "UB": "Greater London", "IG": "Greater London", "W": "Greater London", "KT": "Greater London",
-            "WC": "Greater London", "WD": "Greater London"
-        }
-
-        # Create region columns for collection and delivery postcodes
-        data['CollRegion'] = data['CollOutwardCode'].map(postcode_to_region).fillna("Unknown")
-        data['DelRegion'] = data['DelOutwardCode'].map(postcode_to_region).fillna("Unknown")
-
-
         # Add a toggle checkbox to show/hide the dataset preview
         if st.checkbox("Show Dataset Preview", value=False): 
             st.subheader("Dataset Preview")
-            st.dataframe(data, width=1800, height=400)  # Adjust dimensions if needed
+            show_paginated_table(data, np.ones(len(data), dtype=bool), "preview", height=400)
 
         # Sidebar filters
         st.sidebar.title("Filter Options")
+        with stage("filter index", rows_in=len(data)):
+            filter_index = get_filter_index(st.session_state["upload_hash"], data)
+        filters = {}
 
         # Collection region filter
-        coll_regions = data['CollRegion'].unique().tolist()
+        coll_regions = filter_index.options('CollRegion')
         selected_coll_regions = st.sidebar.multiselect("Filter by Collection Region", options=coll_regions)
         if selected_coll_regions:
-            data = data[data['CollRegion'].isin(selected_coll_regions)]
+            filters['CollRegion'] = selected_coll_regions
 
-        # Delivery region filter
-        del_regions = data['DelRegion'].unique().tolist()
+        # Delivery region filter (options limited to the selected collection regions)
+        del_regions = filter_index.options('DelRegion', filter_index.mask(filters))
         selected_del_regions = st.sidebar.multiselect("Filter by Delivery Region", options=del_regions)
         if selected_del_regions:
-            data = data[data['DelRegion'].isin(selected_del_regions)]
+            filters['DelRegion'] = selected_del_regions
 
-        # Other filters
-        filters = {}
-        filter_order = ['Distance', 'StartDate', 'EndDate', 'AgreedDate', 'CustName', 'DelType']
+        # Other filters (options limited to the selected regions)
+        region_mask = filter_index.mask(filters)
+        filter_order = ['Distance', 'DistanceFlag', 'StartDate', 'EndDate', 'AgreedDate', 'CustName', 'DelType']
         for column in filter_order:
-            if column not in data.columns:
+            if column not in filter_index:
                 continue
 
             if column == 'Distance':
-                min_val, max_val = int(data[column].min()), int(data[column].max())
+                value_range = filter_index.value_range(column, region_mask)
+                if value_range is None:
+                    continue
+                # Round outwards so the full slider range keeps fractional distances at either end
+                min_val, max_val = math.floor(value_range[0]), math.ceil(value_range[1])
                 if min_val == max_val:
                     # Handle case where min_val == max_val
                     st.sidebar.write(f"Only one value available for {column}: {min_val}")
@@ -456,42 +462,89 @@ def main():
                         max_value=max_val,
                         value=(min_val, max_val)
                     )
-                    filters[column] = selected_range
+                    # The full range means no filter, so rows without a distance stay in
+                    if selected_range != (min_val, max_val):
+                        filters[column] = selected_range
             else:
                 # Handle non-numeric columns with a multiselect
-                unique_values = data[column].unique().tolist()
+                unique_values = filter_index.options(column, region_mask)
                 selected_values = st.sidebar.multiselect(f"Filter {column}", options=unique_values)
                 if selected_values:
                     filters[column] = selected_values
 
-        # Apply other filters
-        for column, filter_value in filters.items():
-            if isinstance(filter_value, tuple):  # Slider filter
-                data = data[(data[column] >= filter_value[0]) & (data[column] <= filter_value[1])]
-            elif isinstance(filter_value, list):  # Dropdown filter
-                data = data[data[column].isin(filter_value)]
+        # Apply all filters as one combined mask and take a single filtered view
+        with stage("filtering", rows_in=len(data)) as record:
+            filter_mask = filter_index.mask(filters)
+            record["rows_out"] = int(filter_mask.sum())
+
+        # Radius searches over the geocoded coordinates
+        st.sidebar.subheader("Radius Search")
+        with stage("spatial index", rows_in=len(data)):
+            spatial_indexes = get_spatial_indexes(st.session_state["upload_hash"], data)
+
+        near_postcode = normalize_postcode(st.sidebar.text_input("Collections near postcode"))
+        if near_postcode:
+            collection_radius = st.sidebar.slider("Collection radius (miles)", min_value=1, max_value=200, value=25)
+            near_lat, near_lon = find_postcode(near_postcode)
+            if near_lat is None:
+                st.sidebar.warning(f"Could not find postcode {near_postcode}")
+            else:
+                with stage("radius search", rows_in=len(data)) as record:
+                    filter_mask &= spatial_indexes['Coll'].within_mask(near_lat, near_lon, collection_radius)
+                    record["rows_out"] = int(filter_mask.sum())
+
+        backload_job = st.sidebar.text_input("Deliveries near the collection of job").strip().replace(',', '')
+        if backload_job:
+            delivery_radius = st.sidebar.slider("Delivery radius (miles)", min_value=1, max_value=200, value=25)
+            job_rows = np.flatnonzero(data['JobNumber'].to_numpy() == backload_job)
+            if not len(job_rows) or pd.isna(data['CollLat'].iat[job_rows[0]]):
+                st.sidebar.warning(f"No collection location found for job {backload_job}")
+            else:
+                job_lat, job_lon = data['CollLat'].iat[job_rows[0]], data['CollLon'].iat[job_rows[0]]
+                with stage("radius search", rows_in=len(data)) as record:
+                    filter_mask &= spatial_indexes['Del'].within_mask(job_lat, job_lon, delivery_radius)
+                    record["rows_out"] = int(filter_mask.sum())
 
-        # Display filtered dataset
+        # Display filtered dataset (one page at a time)
         st.markdown('<div class="center-content">', unsafe_allow_html=True)
         st.subheader("Filtered Dataset")
-        st.dataframe(data, width=1800, height=800)
+        with stage("table render", rows_in=int(filter_mask.sum())):
+            show_paginated_table(data, filter_mask, "filtered", height=800)
         st.markdown('</div>', unsafe_allow_html=True)
 
-        # Export filtered data
-        if st.button("Export Filtered Data"):
-            try:
-                buffer = io.BytesIO()
-                data.to_csv(buffer, index=False)
-                buffer.seek(0)
-                st.download_button("Download Filtered Data", data=buffer, file_name="filtered_data.csv", mime="text/csv")
-            except Exception as e:
-                st.error(f"An error occurred while exporting the file: {e}")
-                
-        # Generate the map
-        folium_map = create_folium_map(data)
-
-        # Render the map
-        st_folium(folium_map, width=1800, height=900)
+        data = data[filter_mask]
+
+        # Export filtered data (each file is only generated when its button is clicked)
+        export_columns = st.columns(len(EXPORT_FORMATS))
+        for export_column, (export_format, mime) in zip(export_columns, EXPORT_FORMATS.items()):
+            export_column.download_button(
+                f"Download Filtered Data ({export_format.upper()})",
+                data=functools.partial(export_jobs, data, export_format),
+                file_name=f"filtered_data.{export_format}",
+                mime=mime,
+            )
+
+        # Generate the map (clustered or grid-aggregated for large result sets),
+        # reusing the last one while the filtered rows and render mode are unchanged
+        map_mode = st.sidebar.selectbox("Map Rendering", options=MAP_MODES)
+        folium_map = get_session_map(st.session_state["upload_hash"], filter_mask, map_mode, data)
+
+        # Render the map, keeping the user's view across rebuilds
+        from streamlit_folium import st_folium  # Imported on first use; it pulls in folium
+
+        with stage("st_folium", rows_in=len(data)):
+            map_state = st_folium(
+                folium_map,
+                key="job_map",
+                width=1800,
+                height=900,
+                center=st.session_state.get("map_center"),
+                zoom=st.session_state.get("map_zoom"),
+                returned_objects=["center", "zoom"],
+            )
+        if map_state and map_state.get("center"):
+            st.session_state["map_center"] = (map_state["center"]["lat"], map_state["center"]["lng"])
+            st.session_state["map_zoom"] = map_state["zoom"]
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,206 @@
+"""
+Headless batch run of the BCA filter pipeline:
+ingestion -> geocoding -> region tagging -> filtering -> export.
+
+Extracts keep every column of the input, except CSVs of CHUNKED_CSV_BYTES
+(50 MB) or more: like the app, those are streamed in chunks and only the
+job columns (job_pipeline.JOB_DTYPES) are kept.
+
+Example:
+    python bca_batch.py exports/ --output-dir extracts/ --coll-region "North West" \
+        --max-distance 150 --format parquet --workers 4
+"""
+import argparse
+import functools
+import hashlib
+import math
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from geocode_store import DEFAULT_DB_PATH, GeocodeStore
+from geocoding import DEFAULT_RATE_LIMIT, TokenBucket
+from job_pipeline import CHUNKED_CSV_BYTES, enrich_jobs, filter_jobs, ingest_csv_chunked, read_jobs_cached
+from pipeline_metrics import DEFAULT_METRICS_PATH, PipelineMetrics, collecting, stage
+from postcode_centroids import DEFAULT_CENTROIDS_PATH, load_centroid_geocoder
+
+
+# File types picked up when an input is a directory
+INPUT_EXTENSIONS = ('.xlsx', '.csv', '.parquet', '.arrow', '.feather')
+
+OUTPUT_FORMATS = ('csv', 'parquet')
+
+
+def find_inputs(paths):
+    """Expand directories into the job exports they contain, keeping explicit files as given."""
+    inputs = []
+    for path in paths:
+        if os.path.isdir(path):
+            inputs.extend(
+                os.path.join(path, name) for name in sorted(os.listdir(path)) if name.endswith(INPUT_EXTENSIONS)
+            )
+        else:
+            inputs.append(path)
+    return inputs
+
+
+def build_filters(args):
+    """Translate command-line filter options into the pipeline's filters dict."""
+    filters = {}
+    if args.coll_region:
+        filters['CollRegion'] = args.coll_region
+    if args.del_region:
+        filters['DelRegion'] = args.del_region
+    if args.customer:
+        filters['CustName'] = args.customer
+    if args.del_type:
+        filters['DelType'] = args.del_type
+    if args.min_distance is not None or args.max_distance is not None:
+        low = args.min_distance if args.min_distance is not None else -math.inf
+        high = args.max_distance if args.max_distance is not None else math.inf
+        filters['Distance'] = (low, high)
+    return filters
+
+
+@functools.lru_cache(maxsize=None)
+def get_centroid_geocoder(centroids_path):
+    # Loaded once per worker process and reused for every file it handles
+    return load_centroid_geocoder(centroids_path)
+
+
+def write_output(data, output_path, output_format):
+    if output_format == 'parquet':
+        data.to_parquet(output_path, index=False)
+    else:
+        data.to_csv(output_path, index=False)
+
+
+def process_file(input_path, output_dir, output_format, filters, rate, geocode_db, centroids_path,
+                 metrics_log=DEFAULT_METRICS_PATH):
+    """
+    Run the full pipeline on one job export and write the filtered extract.
+    Runs in a worker process, so it opens its own store and geocoder.
+    Stage timings are appended to `metrics_log`.
+    """
+    start_time = time.time()
+    metrics = PipelineMetrics(input=input_path)
+    store = GeocodeStore(geocode_db)
+    try:
+        with collecting(metrics):
+            rate_limiter = TokenBucket(rate)
+            centroid_geocoder = get_centroid_geocoder(centroids_path)
+            if input_path.endswith('.csv') and os.path.getsize(input_path) >= CHUNKED_CSV_BYTES:
+                # Stream large CSVs from disk in chunks, geocoding while reading (job columns only, as in the app)
+                data, geocode_report = ingest_csv_chunked(
+                    input_path, rate_limiter, centroid_geocoder=centroid_geocoder, store=store
+                )
+            else:
+                with open(input_path, 'rb') as input_file:
+                    file_bytes = input_file.read()
+                data = read_jobs_cached(
+                    file_bytes, os.path.basename(input_path), hashlib.sha256(file_bytes).hexdigest()
+                )
+                data, geocode_report = enrich_jobs(
+                    data, rate_limiter, centroid_geocoder=centroid_geocoder, store=store
+                )
+            rows_in = len(data)
+            data = filter_jobs(data, filters)
+
+            stem = os.path.splitext(os.path.basename(input_path))[0]
+            output_path = os.path.join(output_dir, f"{stem}_filtered.{output_format}")
+            with stage("write output", rows_in=len(data)):
+                write_output(data, output_path, output_format)
+    finally:
+        store.close()
+        metrics.write(metrics_log)
+
+    return {
+        "input": input_path,
+        "output": output_path,
+        "rows_in": rows_in,
+        "rows_out": len(data),
+        "geocode_offline": geocode_report["offline"],
+        "geocode_stored": geocode_report["stored"],
+        "geocode_fetched": len(geocode_report["fetched"]),
+        "geocode_failed": len(geocode_report["failed"]),
+        "unreadable_dates": sum(geocode_report["unreadable_dates"].values()),
+        "seconds": time.time() - start_time,
+    }
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Clean, geocode, region-tag and filter BCA job exports.")
+    parser.add_argument("inputs", nargs="+", help="Job export files (.xlsx/.csv/.parquet/.arrow/.feather) or directories of them")
+    parser.add_argument("--output-dir", default=".", help="Where filtered extracts are written (default: current directory)")
+    parser.add_argument("--format", dest="output_format", choices=OUTPUT_FORMATS, default="csv", help="Output format")
+    parser.add_argument("--coll-region", action="append", help="Keep jobs collected in this region (repeatable)")
+    parser.add_argument("--del-region", action="append", help="Keep jobs delivered to this region (repeatable)")
+    parser.add_argument("--customer", action="append", help="Keep jobs for this CustName (repeatable)")
+    parser.add_argument("--del-type", action="append", help="Keep jobs with this DelType (repeatable)")
+    parser.add_argument("--min-distance", type=float, help="Minimum Distance")
+    parser.add_argument("--max-distance", type=float, help="Maximum Distance")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(), help="Worker processes (default: CPU count)")
+    parser.add_argument(
+        "--rate", type=float, default=DEFAULT_RATE_LIMIT,
+        help="Total network geocoding requests per second, shared between workers",
+    )
+    parser.add_argument("--geocode-db", default=DEFAULT_DB_PATH, help="Persistent geocode store")
+    parser.add_argument("--centroids", default=DEFAULT_CENTROIDS_PATH, help="Offline postcode-centroid dataset")
+    parser.add_argument(
+        "--metrics-log", default=DEFAULT_METRICS_PATH,
+        help="JSON-lines file per-stage timings are appended to (empty to disable)",
+    )
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    inputs = find_inputs(args.inputs)
+    if not inputs:
+        print("No job exports found.", file=sys.stderr)
+        return 1
+
+    if not os.path.exists(args.centroids):
+        print(
+            f"No offline postcode dataset at {args.centroids}; every new postcode will be looked up online "
+            "(build one with build_postcode_centroids.py).",
+            file=sys.stderr,
+        )
+
+    os.makedirs(args.output_dir, exist_ok=True)
+    filters = build_filters(args)
+    workers = max(1, min(args.workers or 1, len(inputs)))
+    # Each process gets an equal share of the rate limit so the total stays within it
+    rate = args.rate / workers
+
+    failures = 0
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        future_to_input = {
+            executor.submit(
+                process_file, path, args.output_dir, args.output_format, filters, rate, args.geocode_db,
+                args.centroids, args.metrics_log,
+            ): path
+            for path in inputs
+        }
+        for future in as_completed(future_to_input):
+            try:
+                result = future.result()
+            except Exception as e:
+                failures += 1
+                print(f"{future_to_input[future]}: failed: {e}", file=sys.stderr)
+                continue
+            print(
+                f"{result['input']}: {result['rows_in']} -> {result['rows_out']} rows "
+                f"(geocode {result['geocode_offline']} offline, {result['geocode_stored']} from store, "
+                f"{result['geocode_fetched']} fetched, "
+                f"{result['geocode_failed']} failed) in {result['seconds']:.1f}s -> {result['output']}"
+            )
+            if result['unreadable_dates']:
+                print(f"{result['input']}: {result['unreadable_dates']} unreadable dates left blank", file=sys.stderr)
+
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,447 @@
+"""
+Benchmarks for the BCA filter pipeline on synthetic job exports.
+
+Generates reproducible job files (comma-formatted job numbers, postcodes in
+every area of the region table, messy casing and spacing, mixed-type
+references, blank dates), then times reading, cleaning, geocoding against a
+local fake geocoder (cold, then from the store), tagging, filtering and map
+building separately. Results are appended as JSON lines with the release
+label, so runs can be compared across changes. A run whose output is wrong
+(dates lost in parsing, or the chunked CSV reader disagreeing with the
+whole-file pipeline) stops the benchmark without recording its timings.
+
+Example:
+    python bca_benchmark.py --rows 1000 10000 200000 --output bench.jsonl
+    python bca_benchmark.py --rows 200000 --output new.jsonl --compare bench.jsonl
+    python bca_benchmark.py --rows 50000 --generate jobs_50k.csv
+"""
+import argparse
+import contextvars
+import math
+import os
+import sys
+import tempfile
+import threading
+import time
+import zlib
+
+import numpy as np
+import pandas as pd
+
+from filter_index import DATE_COLUMNS, FilterIndex
+from geocode_service import GeocodeService
+from geocode_store import GeocodeStore
+from geocoding import DEFAULT_WORKERS, TokenBucket
+from job_map import MAP_MODES, create_folium_map
+from job_pipeline import (
+    add_distances, clean_jobs, geocode_postcodes, ingest_csv_chunked, load_postcode_regions, read_jobs, tag_jobs,
+    unique_postcodes,
+)
+from pipeline_metrics import PipelineMetrics, collecting, stage
+from spatial_index import haversine_miles
+
+
+DEFAULT_ROWS = [1_000, 10_000, 100_000]
+
+# Distinct customers; job counts per customer fall off like a Zipf distribution
+DEFAULT_CUSTOMERS = 300
+
+DEL_TYPES = ["Standard", "Express", "Trade", "Auction", "Retail", "Transfer"]
+DEL_TYPE_WEIGHTS = [0.45, 0.15, 0.15, 0.1, 0.1, 0.05]
+
+# Date formats seen in job exports
+DATE_FORMATS = {
+    "uk": "%d/%m/%Y", "iso": "%Y-%m-%d", "uk-time": "%d/%m/%Y %H:%M", "uk-short": "%d/%m/%y",
+    "iso-t": "%Y-%m-%dT%H:%M:%S", "text": "%d %b %Y",
+}
+
+# Share of postcodes outside every known area; the fake geocoder can't find them
+UNKNOWN_AREA = "ZZ"
+UNKNOWN_POSTCODE_SHARE = 0.01
+
+# Rough bounding box of Great Britain, for fake area centres
+UK_LAT = (50.2, 58.5)
+UK_LON = (-5.5, 1.6)
+
+# Spread of fake postcode locations around their area centre, in degrees
+AREA_SPREAD_DEGREES = 0.2
+
+# Run as fast as the fake geocoder allows
+UNLIMITED_RATE = 1e9
+
+# Shared geocoding service scenario: rate limit (lookups per second) and
+# distinct postcodes the simulated sessions draw their overlapping sets from
+DEFAULT_SERVICE_RATE = 500.0
+SHARED_GEOCODING_POSTCODES = 2000
+
+_UNIT_LETTERS = np.array(list("ABDEFGHJLNPQRSTUWXYZ"))
+
+
+def _unit_interval(key, salt):
+    """Deterministic pseudo-random number in [0, 1) derived from a string."""
+    return zlib.crc32(f"{salt}:{key}".encode()) / 2 ** 32
+
+
+class FakeGeocoder:
+    """
+    Stand-in for the network geocoder with the same call signature.
+
+    Each postcode area gets a fixed centre inside Great Britain and each
+    postcode a fixed offset from it, so results are the same in every run and
+    process. Unknown areas return (None, None). `latency` seconds are slept
+    per lookup to imitate a network round trip.
+    """
+
+    def __init__(self, latency=0.0):
+        self.latency = latency
+
+    @staticmethod
+    def locate(postcode):
+        area = postcode[:2].rstrip("0123456789").upper()
+        if area == UNKNOWN_AREA:
+            return None, None
+        lat = UK_LAT[0] + (UK_LAT[1] - UK_LAT[0]) * _unit_interval(area, "lat")
+        lon = UK_LON[0] + (UK_LON[1] - UK_LON[0]) * _unit_interval(area, "lon")
+        lat += AREA_SPREAD_DEGREES * (2 * _unit_interval(postcode, "lat") - 1)
+        lon += AREA_SPREAD_DEGREES * (2 * _unit_interval(postcode, "lon") - 1)
+        return round(lat, 6), round(lon, 6)
+
+    def __call__(self, postcode, rate_limiter=None):
+        if rate_limiter is not None:
+            rate_limiter.acquire()
+        if self.latency:
+            time.sleep(self.latency)
+        return self.locate(postcode)
+
+
+def _postcode_pool(size, rng):
+    """Distinct, normalized postcodes spread over every area in the region table."""
+    areas = np.append(load_postcode_regions().index.to_numpy(dtype=object), UNKNOWN_AREA)
+    weights = np.full(len(areas), (1 - UNKNOWN_POSTCODE_SHARE) / (len(areas) - 1))
+    weights[-1] = UNKNOWN_POSTCODE_SHARE
+    # Draw extra candidates so enough remain after dropping duplicates
+    count = int(size * 1.3) + 10
+    pool = pd.Series(
+        areas[rng.choice(len(areas), count, p=weights)]
+        + rng.integers(1, 30, count).astype(str) + " "
+        + rng.integers(0, 10, count).astype(str)
+        + _UNIT_LETTERS[rng.integers(0, len(_UNIT_LETTERS), count)]
+        + _UNIT_LETTERS[rng.integers(0, len(_UNIT_LETTERS), count)]
+    ).drop_duplicates()
+    return pool.to_numpy(dtype=object)[:size]
+
+
+def _messy_postcodes(postcodes, rng):
+    """Postcodes as typed into exports: some lower-case, without a space or padded."""
+    postcodes = pd.Series(postcodes, dtype=object)
+    style = rng.random(len(postcodes))
+    postcodes = postcodes.where(style >= 0.10, postcodes.str.lower())
+    postcodes = postcodes.where((style < 0.10) | (style >= 0.15), postcodes.str.replace(" ", "", regex=False))
+    postcodes = postcodes.where((style < 0.15) | (style >= 0.18), "  " + postcodes + " ")
+    return postcodes
+
+
+def _dates(start, date_format, rng, blank_share=0.05):
+    """Formatted dates, with a share left blank."""
+    dates = pd.Series(start.strftime(date_format), dtype=object)
+    return dates.where(rng.random(len(dates)) >= blank_share, np.nan)
+
+
+def generate_jobs(rows, seed=0, customers=DEFAULT_CUSTOMERS, date_format=DATE_FORMATS["uk"]):
+    """
+    A synthetic job export of `rows` rows with the columns the pipeline reads,
+    reproducible from `seed`.
+    """
+    rng = np.random.default_rng(seed)
+
+    # Collection points repeat more than delivery points (depots, auction sites)
+    pool = _postcode_pool(max(100, rows // 4), rng)
+    coll = pool[rng.zipf(1.6, rows) % len(pool)]
+    dele = pool[rng.integers(0, len(pool), rows)]
+
+    # Reported road distances: longer than the straight line, with some blanks and outliers
+    coords = {postcode: FakeGeocoder.locate(postcode) for postcode in pool}
+    coll_lat, coll_lon = np.array([coords[postcode] for postcode in coll], dtype="float64").T
+    del_lat, del_lon = np.array([coords[postcode] for postcode in dele], dtype="float64").T
+    distance = haversine_miles(coll_lat, coll_lon, del_lat, del_lon) * rng.uniform(1.1, 1.6, rows)
+    distance = np.where(rng.random(rows) < 0.01, distance * 5 + 50, distance)
+    distance = pd.Series(np.round(distance, 1)).where(rng.random(rows) >= 0.03)
+
+    # Customer sizes fall off with rank
+    ranks = np.arange(1, customers + 1)
+    customer_weights = 1 / ranks / (1 / ranks).sum()
+    customer_names = np.array([f"Customer {rank:04d} Ltd" for rank in ranks], dtype=object)
+
+    # Reference numbers are a mix of integers, strings and blanks
+    reference_style = rng.random(rows)
+    references = pd.Series(rng.integers(10_000, 99_999, rows), dtype=object)
+    references = references.where(reference_style < 0.6, "REF-" + references.astype(str))
+    references = references.where(reference_style < 0.9, np.nan)
+
+    start = pd.Timestamp("2024-01-01") + pd.to_timedelta(rng.integers(0, 730, rows), unit="D")
+    start = start + pd.to_timedelta(rng.integers(7, 19, rows), unit="h")
+
+    return pd.DataFrame({
+        "JobNumber": pd.Series(np.arange(1_000_000, 1_000_000 + rows)).map("{:,}".format),
+        "CollPostCode": _messy_postcodes(coll, rng),
+        "DelPostCode": _messy_postcodes(dele, rng),
+        "CustName": customer_names[rng.choice(customers, rows, p=customer_weights)],
+        "DelType": np.array(DEL_TYPES, dtype=object)[rng.choice(len(DEL_TYPES), rows, p=DEL_TYPE_WEIGHTS)],
+        "CustRef3": references,
+        "StartDate": _dates(start, date_format, rng),
+        "EndDate": _dates(start + pd.to_timedelta(rng.integers(0, 15, rows), unit="D"), date_format, rng),
+        "AgreedDate": _dates(start - pd.to_timedelta(rng.integers(0, 31, rows), unit="D"), date_format, rng),
+        "Distance": distance,
+    })
+
+
+def write_jobs(data, path):
+    if path.endswith(".parquet"):
+        # Parquet columns have one type, so mixed references are written as text like a CSV would be
+        references = data["CustRef3"]
+        data.assign(CustRef3=references.where(references.isna(), references.astype(str))).to_parquet(path, index=False)
+    else:
+        data.to_csv(path, index=False)
+
+
+def filter_scenarios(data):
+    """Representative sidebar selections: busiest region, plus distance, top customers."""
+    busiest_region = data["CollRegion"].value_counts().index[0]
+    top_customers = data["CustName"].value_counts().index[:5].tolist()
+    return {
+        "region": {"CollRegion": [busiest_region]},
+        "region+distance": {"CollRegion": [busiest_region], "Distance": (0, 100)},
+        "customers": {"CustName": top_customers},
+    }
+
+
+def chunked_differences(whole, chunked):
+    """
+    Columns of the chunked reader's output whose values differ from the
+    whole-file pipeline's on the same file (compared as text, since the two
+    paths use different dtypes), with the number of rows that differ.
+    """
+    differences = {}
+    if len(whole) != len(chunked):
+        return {"(row count)": abs(len(whole) - len(chunked))}
+    for column in chunked.columns:
+        if column not in whole.columns:
+            continue
+        whole_values = whole[column].astype(object).astype(str).reset_index(drop=True)
+        chunked_values = chunked[column].astype(object).astype(str).reset_index(drop=True)
+        both_missing = whole_values.isna() & chunked_values.isna()
+        differing = int(((whole_values != chunked_values) & ~both_missing).sum())
+        if differing:
+            differences[column] = differing
+    return differences
+
+
+def lost_dates(raw, cleaned):
+    """Date columns with values in the raw export that cleaning turned blank, with how many."""
+    lost = {}
+    for column in DATE_COLUMNS:
+        if column in raw.columns:
+            count = int(raw[column].notna().sum() - cleaned[column].notna().sum())
+            if count:
+                lost[column] = count
+    return lost
+
+
+def benchmark_file(path, map_modes, geocode_latency, work_dir, **context):
+    """
+    Time each pipeline stage on one job file. Returns the PipelineMetrics of
+    the in-memory pipeline and of the chunked CSV reader (None for other formats).
+
+    Raises ValueError instead if the pipeline loses dates or the two readers
+    disagree, so timings of a run with wrong output are never reported.
+    """
+    geocoder = FakeGeocoder(geocode_latency)
+    rate_limiter = TokenBucket(UNLIMITED_RATE)
+    store_path = os.path.join(work_dir, f"geocode_{os.getpid()}_{time.time_ns()}.sqlite3")
+    store = GeocodeStore(store_path)
+
+    pipeline = PipelineMetrics(scenario="pipeline", **context)
+    chunked = None
+    try:
+        with collecting(pipeline):
+            with open(path, "rb") as job_file:
+                file_bytes = job_file.read()
+            data = read_jobs(file_bytes, os.path.basename(path))
+            raw_dates = data[[column for column in DATE_COLUMNS if column in data.columns]].copy()
+            data = clean_jobs(data)
+            lost = lost_dates(raw_dates, data)
+            if lost:
+                raise ValueError(f"Date parsing blanked dates present in the file: {lost}")
+
+            # Cold geocode through the fake network geocoder, then the same postcodes again from the store
+            postcodes = unique_postcodes(data)
+            with stage("geocode cold (total)", rows_in=len(postcodes)):
+                geocode_postcodes(postcodes, rate_limiter, store=store, geocode=geocoder)
+            with stage("geocode warm (total)", rows_in=len(postcodes)):
+                geocode_dict, _ = geocode_postcodes(postcodes, rate_limiter, store=store, geocode=geocoder)
+            data = add_distances(tag_jobs(data, geocode_dict))
+
+            with stage("filter index", rows_in=len(data)):
+                filter_index = FilterIndex(data)
+            for name, filters in filter_scenarios(data).items():
+                with stage(f"filtering ({name})", rows_in=len(data)) as record:
+                    record["rows_out"] = int(filter_index.mask(filters).sum())
+
+            for mode in map_modes:
+                with stage(f"map build ({mode})", rows_in=len(data)):
+                    folium_map = create_folium_map(data, mode=mode)
+                with stage(f"map render ({mode})", rows_in=len(data)) as record:
+                    record["html_bytes"] = len(folium_map.get_root().render())
+
+        if path.endswith(".csv"):
+            chunked = PipelineMetrics(scenario="chunked", **context)
+            with collecting(chunked), stage("chunked ingest (total)") as record:
+                chunked_data, _ = ingest_csv_chunked(path, rate_limiter, store=store, geocode=geocoder)
+                record["rows_out"] = len(chunked_data)
+            # Both readers must produce the same jobs from the same file
+            differences = chunked_differences(data, chunked_data)
+            if differences:
+                raise ValueError(f"Chunked reader output differs from the whole-file pipeline: {differences}")
+    finally:
+        store.close()
+        for suffix in ("", "-wal", "-shm"):
+            if os.path.exists(store_path + suffix):
+                os.remove(store_path + suffix)
+
+    return pipeline, chunked
+
+
+def benchmark_shared_geocoding(path, sessions, rate, geocode_latency, **context):
+    """
+    Geocode overlapping postcode sets from `sessions` concurrent sessions
+    through one GeocodeService over the fake geocoder, as several planners
+    uploading similar files at once would. Records lookups made against
+    requests received, and the throughput achieved under `rate`.
+    """
+    metrics = PipelineMetrics(scenario=f"shared geocoding ({sessions} sessions)", **context)
+    with open(path, "rb") as job_file:
+        data = clean_jobs(read_jobs(job_file.read(), os.path.basename(path)))
+    postcodes = list(unique_postcodes(data)[:SHARED_GEOCODING_POSTCODES])
+
+    # Each session asks for half of the postcodes, starting at a different offset
+    span = max(1, len(postcodes) // 2)
+    step = max(1, len(postcodes) // (2 * sessions))
+    # Enough workers to keep `rate` lookups per second in flight at the fake latency
+    workers = min(64, max(DEFAULT_WORKERS, math.ceil(rate * geocode_latency) + 1))
+    service = GeocodeService(FakeGeocoder(geocode_latency), TokenBucket(rate), workers=workers)
+    try:
+        with collecting(metrics), stage("all sessions") as record:
+            threads = [
+                threading.Thread(
+                    target=contextvars.copy_context().run,
+                    args=(geocode_postcodes, postcodes[index * step:index * step + span], None),
+                    kwargs={"service": service.for_caller(index)},
+                )
+                for index in range(sessions)
+            ]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            stats = service.stats()
+            record.update(rows_in=stats["requested"], rows_out=stats["looked_up"], coalesced=stats["coalesced"])
+        record["lookups_per_second"] = round(stats["looked_up"] / record["seconds"], 1)
+    finally:
+        service.close()
+    return metrics
+
+
+def summarize(records):
+    """
+    Seconds per (scenario, stage) and row count, stages in run order. Repeated
+    stages (per chunk, cold and warm geocoding) are summed within a run, then
+    the median is taken over runs.
+    """
+    frame = pd.DataFrame(records)
+    per_run = frame.groupby(["run", "scenario", "stage", "rows"], as_index=False, sort=False)["seconds"].sum()
+    summary = per_run.pivot_table(index=["scenario", "stage"], columns="rows", values="seconds", aggfunc="median")
+    order = frame.drop_duplicates(["scenario", "stage"]).set_index(["scenario", "stage"]).index
+    return summary.reindex(order)
+
+
+def load_records(path):
+    return pd.read_json(path, lines=True).to_dict("records")
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the BCA filter pipeline on synthetic job exports.")
+    parser.add_argument("--rows", type=int, nargs="+", default=DEFAULT_ROWS, help="File sizes to benchmark")
+    parser.add_argument("--seed", type=int, default=0, help="Generator seed")
+    parser.add_argument("--customers", type=int, default=DEFAULT_CUSTOMERS, help="Distinct CustName values")
+    parser.add_argument("--date-format", choices=DATE_FORMATS, default="uk", help="Format of the date columns")
+    parser.add_argument("--format", dest="file_format", choices=("csv", "parquet"), default="csv", help="Job file format")
+    parser.add_argument("--map-modes", nargs="*", choices=MAP_MODES, default=["Auto", "Grid"], help="Map modes to time")
+    parser.add_argument("--geocode-latency", type=float, default=0.0, help="Seconds per fake geocoder lookup")
+    parser.add_argument(
+        "--sessions", type=int, default=0,
+        help="Also geocode overlapping postcodes from this many concurrent sessions through the shared service",
+    )
+    parser.add_argument(
+        "--service-rate", type=float, default=DEFAULT_SERVICE_RATE,
+        help="Shared service rate limit (lookups per second) for --sessions",
+    )
+    parser.add_argument("--repeat", type=int, default=1, help="Runs per size (the summary shows the median)")
+    parser.add_argument("--output", default="benchmark_results.jsonl", help="JSON-lines file results are appended to")
+    parser.add_argument("--compare", help="Earlier results file to compare the medians against")
+    parser.add_argument("--keep-files", help="Directory to keep the generated job files in")
+    parser.add_argument("--generate", metavar="PATH", help="Only write a job file of the first --rows size to PATH")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    date_format = DATE_FORMATS[args.date_format]
+
+    if args.generate:
+        write_jobs(generate_jobs(args.rows[0], args.seed, args.customers, date_format), args.generate)
+        print(f"Wrote {args.rows[0]:,} jobs to {args.generate}")
+        return 0
+
+    records = []
+    with tempfile.TemporaryDirectory() as work_dir:
+        job_dir = args.keep_files or work_dir
+        os.makedirs(job_dir, exist_ok=True)
+        for rows in args.rows:
+            path = os.path.join(job_dir, f"jobs_{rows}_{args.seed}_{args.date_format}.{args.file_format}")
+            write_jobs(generate_jobs(rows, args.seed, args.customers, date_format), path)
+            for repeat in range(args.repeat):
+                start_time = time.time()
+                context = dict(
+                    rows=rows, seed=args.seed, repeat=repeat, date_format=args.date_format,
+                    file_format=args.file_format, python=sys.version.split()[0], pandas=pd.__version__,
+                )
+                try:
+                    runs = list(benchmark_file(path, args.map_modes, args.geocode_latency, work_dir, **context))
+                except ValueError as e:
+                    print(f"{rows:,} rows, run {repeat + 1}: wrong output, timings not recorded: {e}", file=sys.stderr)
+                    return 1
+                if args.sessions:
+                    runs.append(benchmark_shared_geocoding(
+                        path, args.sessions, args.service_rate, args.geocode_latency, **context
+                    ))
+                for metrics in runs:
+                    if metrics is not None:
+                        metrics.write(args.output)
+                        records.extend(metrics.records())
+                print(f"{rows:,} rows, run {repeat + 1}: {time.time() - start_time:.1f}s", file=sys.stderr)
+
+    summary = summarize(records)
+    pd.set_option("display.width", 200)
+    print("Median seconds per stage:")
+    print(summary.round(4).to_string())
+
+    if args.compare:
+        baseline = summarize(load_records(args.compare))
+        ratio = (summary / baseline.reindex_like(summary)).round(2)
+        print(f"\nRatio to {args.compare} (below 1 is faster):")
+        print(ratio.to_string())
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,88 @@
+"""
+Build the offline postcode-centroid dataset (data/postcode_centroids.csv)
+from the ONS Postcode Directory.
+
+Download the latest ONSPD from the ONS Open Geography Portal
+(https://geoportal.statistics.gov.uk, search for "ONS Postcode Directory"),
+unzip it and point this script at the full CSV in its Data/ folder:
+
+    python build_postcode_centroids.py ONSPD_MAY_2025/Data/ONSPD_MAY_2025_UK.csv
+
+Any CSV with a postcode column (postcode/pcds/pcd) and latitude/longitude
+columns (lat/latitude, lon/long/longitude) works the same way. The app and
+bca_batch.py pick the result up from BCA_POSTCODE_CENTROIDS if set,
+otherwise from data/postcode_centroids.csv.
+"""
+import argparse
+import os
+import sys
+
+import pandas as pd
+
+from postcode_centroids import (
+    _LAT_COLUMNS, _LON_COLUMNS, _POSTCODE_COLUMNS, DEFAULT_CENTROIDS_PATH, _pick_column, split_postcodes,
+)
+
+
+# The ONSPD gives postcodes without a grid reference this latitude
+ONSPD_NO_LOCATION_LAT = 99.999999
+
+# Rows read at a time; the full ONSPD has over 2.5 million postcodes
+CHUNKSIZE = 500_000
+
+
+def build_centroids(source, live_only=False):
+    """Read the postcode, latitude and longitude of every located postcode in `source`."""
+    header = pd.read_csv(source, nrows=0).columns
+    postcode_col = _pick_column(header, _POSTCODE_COLUMNS, "postcode")
+    lat_col = _pick_column(header, _LAT_COLUMNS, "latitude")
+    lon_col = _pick_column(header, _LON_COLUMNS, "longitude")
+    # doterm is the ONSPD's date of termination, blank for live postcodes
+    usecols = [postcode_col, lat_col, lon_col]
+    if live_only and "doterm" in header:
+        usecols.append("doterm")
+
+    chunks = []
+    for chunk in pd.read_csv(source, usecols=usecols, dtype={postcode_col: str, "doterm": str}, chunksize=CHUNKSIZE):
+        if "doterm" in chunk:
+            chunk = chunk[chunk["doterm"].isna()]
+        keys = split_postcodes(chunk[postcode_col])
+        centroids = pd.DataFrame({
+            "postcode": keys["full"].to_numpy(),
+            "latitude": pd.to_numeric(chunk[lat_col], errors="coerce").to_numpy(),
+            "longitude": pd.to_numeric(chunk[lon_col], errors="coerce").to_numpy(),
+        })
+        located = centroids["latitude"].between(-90, 90) & (centroids["latitude"] != ONSPD_NO_LOCATION_LAT)
+        chunks.append(centroids[located].dropna())
+
+    return pd.concat(chunks, ignore_index=True).drop_duplicates("postcode", keep="last")
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Build the offline postcode-centroid dataset from an ONSPD extract.")
+    parser.add_argument("source", help="ONS Postcode Directory CSV (or any postcode/latitude/longitude CSV)")
+    parser.add_argument("--output", default=DEFAULT_CENTROIDS_PATH, help="Where to write the dataset")
+    parser.add_argument("--live-only", action="store_true", help="Leave out terminated postcodes")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    try:
+        centroids = build_centroids(args.source, live_only=args.live_only)
+    except (OSError, ValueError) as e:
+        print(f"{args.source}: {e}", file=sys.stderr)
+        return 1
+
+    output_dir = os.path.dirname(os.path.abspath(args.output))
+    os.makedirs(output_dir, exist_ok=True)
+    # Write then rename so a running app never loads a partial file
+    temp_path = f"{args.output}.{os.getpid()}.tmp"
+    centroids.to_csv(temp_path, index=False, float_format="%.6f")
+    os.replace(temp_path, args.output)
+    print(f"Wrote {len(centroids)} postcodes to {args.output}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,110 @@
+import numpy as np
+import pandas as pd
+
+
+# Columns offered as multiselect filters, in sidebar order
+CATEGORY_COLUMNS = [
+    'CollRegion', 'DelRegion', 'StartDate', 'EndDate', 'AgreedDate', 'CustName', 'DelType', 'DistanceFlag'
+]
+
+# Columns offered as range (slider) filters
+RANGE_COLUMNS = ['Distance']
+
+# Columns holding dd/mm/YYYY date strings
+DATE_COLUMNS = ['StartDate', 'EndDate', 'AgreedDate']
+
+
+class FilterIndex:
+    """
+    Filter structures built once per dataset.
+
+    Multiselect columns are held as integer codes with their option list,
+    range columns as a sorted numeric array. Filters are given as a dict of
+    column -> list of values (multiselect) or (low, high) tuple (range), the
+    same shape the sidebar builds, and are evaluated into one boolean mask.
+    """
+
+    def __init__(self, data):
+        self.n_rows = len(data)
+        self.codes = {}
+        self.values = {}
+        self.numeric = {}
+        self.order = {}
+        self.sorted = {}
+
+        for column in CATEGORY_COLUMNS:
+            if column not in data.columns:
+                continue
+            # Options in order of first appearance, missing values included (like Series.unique)
+            codes, uniques = pd.factorize(data[column], use_na_sentinel=False)
+            self.codes[column] = codes
+            self.values[column] = list(uniques)
+
+        for column in RANGE_COLUMNS:
+            if column not in data.columns:
+                continue
+            numeric = pd.to_numeric(data[column], errors='coerce').to_numpy(dtype='float64')
+            if np.isnan(numeric).all():
+                continue
+            # Sorted positions, NaN last, so range lookups are two binary searches
+            self.numeric[column] = numeric
+            self.order[column] = np.argsort(numeric, kind='stable')
+            self.sorted[column] = numeric[self.order[column]]
+
+    def __contains__(self, column):
+        return column in self.codes or column in self.numeric
+
+    def options(self, column, mask=None):
+        """Option list for a multiselect column, limited to rows in `mask` if given."""
+        values = self.values[column]
+        if mask is None:
+            return list(values)
+        present = np.bincount(self.codes[column][mask], minlength=len(values)) > 0
+        return [value for value, keep in zip(values, present) if keep]
+
+    def value_range(self, column, mask=None):
+        """(min, max) of a range column, limited to rows in `mask` if given; None if empty."""
+        numeric = self.numeric[column]
+        if mask is not None:
+            numeric = numeric[mask]
+        numeric = numeric[~np.isnan(numeric)]
+        if not len(numeric):
+            return None
+        return numeric.min(), numeric.max()
+
+    def column_mask(self, column, selection):
+        """Boolean mask for a single column's selection."""
+        if isinstance(selection, tuple):  # Slider filter
+            order = self.order[column]
+            sorted_values = self.sorted[column]
+            low = np.searchsorted(sorted_values, selection[0], side='left')
+            high = np.searchsorted(sorted_values, selection[1], side='right')
+            mask = np.zeros(self.n_rows, dtype=bool)
+            mask[order[low:high]] = True
+            return mask
+
+        # Dropdown filter: flag the selected codes, then look every row's code up
+        selected = set(selection)
+        wanted = np.array([value in selected for value in self.values[column]], dtype=bool)
+        return wanted[self.codes[column]]
+
+    def mask(self, filters):
+        """Combine every active filter into one boolean mask."""
+        mask = np.ones(self.n_rows, dtype=bool)
+        for column, selection in filters.items():
+            if selection:
+                mask &= self.column_mask(column, selection)
+        return mask
+
+
+def sort_positions(data, column, ascending=True):
+    """
+    Row positions of `data` sorted by `column`, missing values last.
+    Date columns (dd/mm/YYYY strings) are sorted as dates.
+    """
+    values = data[column].reset_index(drop=True)
+    key = None
+    if column in DATE_COLUMNS:
+        key = lambda dates: pd.to_datetime(dates, format='%d/%m/%Y', errors='coerce')
+    ordered = values.sort_values(ascending=ascending, kind='stable', na_position='last', key=key)
+    return ordered.index.to_numpy()
@@ -0,0 +1,211 @@
+import heapq
+import itertools
+import threading
+from concurrent.futures import Future, InvalidStateError, as_completed
+
+from geocoding import DEFAULT_WORKERS, TokenBucket, nominatim_geocode
+
+
+# Request priorities, lowest first: single lookups someone is waiting on go
+# ahead of the postcodes of a bulk upload
+PRIORITY_INTERACTIVE = 0
+PRIORITY_BULK = 1
+
+
+class GeocodeService:
+    """
+    Process-wide geocoding queue shared by every session.
+
+    All lookups go through one priority queue drained by `workers` threads
+    under one rate limiter, so the provider sees the same request rate however
+    many sessions are geocoding. A postcode that is already queued or being
+    looked up is not requested again: later callers get the same Future.
+    Interactive requests are served before bulk ones. Bulk requests are
+    shared fairly between callers (e.g. sessions): each caller's n-th queued
+    postcode goes in round n, counted from the round being served when it
+    joined, so a small upload isn't stuck behind a large one. Asking for a
+    queued postcode at a higher priority or an earlier round moves it up.
+    Throughput reaches the rate limit as long as `workers` covers the rate
+    times the lookup latency.
+
+    `geocode(postcode, rate_limiter)` does the actual lookup, so a local stub
+    can stand in for Nominatim.
+    """
+
+    def __init__(self, geocode=nominatim_geocode, rate_limiter=None, workers=DEFAULT_WORKERS):
+        self.geocode_one = geocode
+        self.rate_limiter = rate_limiter if rate_limiter is not None else TokenBucket()
+        self._queue = []  # Heap of (priority, round, sequence, postcode)
+        self._sequence = itertools.count()
+        self._futures = {}  # Postcode -> Future, while queued or in flight
+        self._queued_key = {}  # Postcode -> (priority, round) it is queued at (absent once taken)
+        self._next_round = {}  # Caller -> round of its next bulk request
+        self._current_round = 0  # Round of the last request taken
+        self._lock = threading.Lock()
+        self._work_available = threading.Condition(self._lock)
+        self._closed = False
+        self.requested = 0
+        self.coalesced = 0
+        self.looked_up = 0
+
+        self._workers = [
+            threading.Thread(target=self._work, name=f"geocode-service-{index}", daemon=True)
+            for index in range(max(1, workers))
+        ]
+        for worker in self._workers:
+            worker.start()
+
+    def submit(self, postcode, priority=PRIORITY_BULK, caller=None):
+        """
+        Queue a lookup, or join the one already pending. Bulk requests are
+        scheduled fairly between `caller`s. Returns a Future of (lat, lon).
+        """
+        with self._lock:
+            if self._closed:
+                raise RuntimeError("GeocodeService is closed")
+            self.requested += 1
+            key = (priority, self._take_round(caller) if priority == PRIORITY_BULK else 0)
+            future = self._futures.get(postcode)
+            # A Future its first caller cancelled is replaced rather than shared
+            if future is not None and not future.cancelled():
+                self.coalesced += 1
+                if key < self._queued_key.get(postcode, key):
+                    # Still waiting in the queue: add it again at the earlier position
+                    self._push(postcode, key)
+                return future
+
+            future = Future()
+            self._futures[postcode] = future
+            self._push(postcode, key)
+            return future
+
+    def _take_round(self, caller):
+        """Round for `caller`'s next bulk request: one after its last, but not before the current round."""
+        round_ = max(self._next_round.get(caller, 0), self._current_round)
+        self._next_round[caller] = round_ + 1
+        return round_
+
+    def _push(self, postcode, key):
+        self._queued_key[postcode] = key
+        heapq.heappush(self._queue, (*key, next(self._sequence), postcode))
+        self._work_available.notify()
+
+    def _take(self):
+        """Next postcode to look up, or None once the service is closed."""
+        with self._lock:
+            while True:
+                while self._queue:
+                    priority, round_, _, postcode = heapq.heappop(self._queue)
+                    # Skip entries superseded by a re-queue at an earlier position
+                    if self._queued_key.get(postcode) != (priority, round_):
+                        continue
+                    del self._queued_key[postcode]
+                    self._current_round = max(self._current_round, round_)
+                    if not self._queued_key:
+                        # Nothing left waiting: every caller starts afresh
+                        self._next_round.clear()
+                        self._current_round = 0
+                    future = self._futures[postcode]
+                    # Once running, the Future can no longer be cancelled; skip it if it already was
+                    if not future.set_running_or_notify_cancel():
+                        del self._futures[postcode]
+                        continue
+                    return postcode, future
+                if self._closed:
+                    return None
+                self._work_available.wait()
+
+    def _work(self):
+        while True:
+            taken = self._take()
+            if taken is None:
+                return
+            postcode, future = taken
+            try:
+                result, error = self.geocode_one(postcode, self.rate_limiter), None
+            except Exception as e:
+                result, error = None, e
+            with self._lock:
+                del self._futures[postcode]
+                self.looked_up += 1
+            # The worker must outlive anything that happens to a caller's Future
+            try:
+                if error is None:
+                    future.set_result(result)
+                else:
+                    future.set_exception(error)
+            except InvalidStateError:
+                pass
+
+    def geocode(self, postcode, rate_limiter=None, priority=PRIORITY_INTERACTIVE):
+        """
+        Look one postcode up and wait for the result. Takes (and ignores) a
+        rate limiter so it can be passed wherever a geocode function is expected.
+        """
+        return self.submit(postcode, priority).result()
+
+    def geocode_many(self, postcodes, priority=PRIORITY_BULK, caller=None):
+        """
+        Queue every postcode at once and yield (postcode, (lat, lon), error)
+        as lookups complete, like geocoding.geocode_many. Bulk lookups are
+        shared fairly with other callers; without a `caller` (e.g. a session
+        id), this call counts as a caller of its own.
+        """
+        if caller is None:
+            caller = object()
+        future_to_postcode = {}
+        for postcode in dict.fromkeys(postcodes):
+            future_to_postcode[self.submit(postcode, priority, caller)] = postcode
+        for future in as_completed(future_to_postcode):
+            postcode = future_to_postcode[future]
+            try:
+                yield postcode, future.result(), None
+            except Exception as e:
+                yield postcode, (None, None), e
+
+    def stats(self):
+        """Requests received, how many joined a pending lookup, lookups made and lookups pending."""
+        with self._lock:
+            return {
+                "requested": self.requested,
+                "coalesced": self.coalesced,
+                "looked_up": self.looked_up,
+                "pending": len(self._futures),
+            }
+
+    def for_caller(self, caller):
+        """This service as seen by one caller: its bulk lookups are queued as `caller`'s."""
+        return CallerGeocodeService(self, caller)
+
+    def close(self):
+        """Stop the workers after their current lookup; queued requests fail."""
+        with self._lock:
+            self._closed = True
+            abandoned = [self._futures.pop(postcode) for postcode in list(self._queued_key)]
+            self._queue.clear()
+            self._queued_key.clear()
+            self._work_available.notify_all()
+        for future in abandoned:
+            if future.set_running_or_notify_cancel():
+                future.set_exception(RuntimeError("GeocodeService is closed"))
+        for worker in self._workers:
+            worker.join()
+
+
+class CallerGeocodeService:
+    """
+    A GeocodeService bound to one caller (e.g. a session), so it can be
+    passed to the pipeline wherever a service is expected and its bulk
+    lookups still queue fairly against other callers.
+    """
+
+    def __init__(self, service, caller):
+        self.service = service
+        self.caller = caller
+        self.rate_limiter = service.rate_limiter
+
+    def geocode(self, postcode, rate_limiter=None, priority=PRIORITY_INTERACTIVE):
+        return self.service.submit(postcode, priority, self.caller).result()
+
+    def geocode_many(self, postcodes, priority=PRIORITY_BULK):
+        return self.service.geocode_many(postcodes, priority, self.caller)
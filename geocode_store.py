@@ -0,0 +1,130 @@
+import os
+import sqlite3
+import threading
+import time
+
+
+# Default location of the on-disk geocode store (override with BCA_GEOCODE_DB)
+DEFAULT_DB_PATH = os.environ.get(
+    "BCA_GEOCODE_DB",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "geocode_cache.sqlite3"),
+)
+
+# Postcodes that could not be resolved are retried after this many seconds
+DEFAULT_MISS_TTL = 7 * 24 * 60 * 60
+
+# SQLite caps the number of bound parameters per statement
+_SQLITE_BATCH = 900
+
+
+def normalize_postcode(postcode):
+    """
+    Normalize a postcode into the key used by the store:
+    upper case, trimmed and with internal whitespace collapsed to one space.
+    """
+    if postcode is None:
+        return None
+    postcode = " ".join(str(postcode).split()).upper()
+    return postcode or None
+
+
+class GeocodeStore:
+    """
+    Persistent postcode -> (lat, lon) store backed by SQLite.
+
+    Resolved postcodes are kept forever, misses are kept for `miss_ttl`
+    seconds so they are not looked up again on every upload. The store keeps
+    running hit/miss counters so the warm-cache ratio can be reported.
+    """
+
+    def __init__(self, path=DEFAULT_DB_PATH, miss_ttl=DEFAULT_MISS_TTL):
+        self.path = path
+        self.miss_ttl = miss_ttl
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        with self._lock, self._conn:
+            # WAL lets several app processes read while one of them writes
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS geocodes (
+                    postcode TEXT PRIMARY KEY,
+                    lat REAL,
+                    lon REAL,
+                    updated_at REAL NOT NULL
+                )
+                """
+            )
+
+    def get_many(self, postcodes):
+        """
+        Look up many postcodes in one go.
+
+        Returns a dict of normalized postcode -> (lat, lon) for every postcode
+        found in the store. Cached misses that are still within their TTL are
+        returned as (None, None); expired misses are left out so they get
+        geocoded again.
+        """
+        keys = sorted({key for key in map(normalize_postcode, postcodes) if key})
+        found = {}
+        expiry = time.time() - self.miss_ttl
+
+        with self._lock:
+            for start in range(0, len(keys), _SQLITE_BATCH):
+                batch = keys[start:start + _SQLITE_BATCH]
+                placeholders = ",".join("?" * len(batch))
+                rows = self._conn.execute(
+                    f"SELECT postcode, lat, lon, updated_at FROM geocodes WHERE postcode IN ({placeholders})",
+                    batch,
+                ).fetchall()
+                for postcode, lat, lon, updated_at in rows:
+                    if lat is None and updated_at < expiry:
+                        continue  # Expired miss, look it up again
+                    found[postcode] = (lat, lon)
+
+            self.hits += len(found)
+            self.misses += len(keys) - len(found)
+
+        return found
+
+    def put_many(self, results):
+        """
+        Store (postcode, (lat, lon)) pairs. A (None, None) result is stored as
+        a miss and will expire after the store's TTL.
+        """
+        now = time.time()
+        rows = []
+        for postcode, (lat, lon) in results:
+            key = normalize_postcode(postcode)
+            if key:
+                rows.append((key, lat, lon, now))
+
+        if not rows:
+            return
+
+        with self._lock, self._conn:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO geocodes (postcode, lat, lon, updated_at) VALUES (?, ?, ?, ?)",
+                rows,
+            )
+
+    def stats(self):
+        """Return hit/miss counters and store size for monitoring."""
+        with self._lock:
+            entries, cached_misses = self._conn.execute(
+                "SELECT COUNT(*), COUNT(*) - COUNT(lat) FROM geocodes"
+            ).fetchone()
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": self.hits / lookups if lookups else 0.0,
+                "entries": entries,
+                "cached_misses": cached_misses,
+            }
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
@@ -0,0 +1,96 @@
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+
+# Nominatim's usage policy allows one request per second; override for other providers
+DEFAULT_RATE_LIMIT = float(os.environ.get("BCA_GEOCODE_RATE", "1.0"))
+DEFAULT_BURST = int(os.environ.get("BCA_GEOCODE_BURST", "1"))
+DEFAULT_WORKERS = int(os.environ.get("BCA_GEOCODE_WORKERS", "4"))
+DEFAULT_RETRIES = 3
+DEFAULT_BACKOFF = 1.0
+
+
+class TokenBucket:
+    """
+    Thread-safe token bucket: `rate` tokens per second, at most `capacity`
+    saved up for bursts. `acquire()` blocks until a token is available.
+    """
+
+    def __init__(self, rate=DEFAULT_RATE_LIMIT, capacity=DEFAULT_BURST):
+        self.rate = rate
+        self.capacity = max(1, capacity)
+        self._tokens = float(self.capacity)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
+
+
+_geolocator = None
+
+
+def get_geolocator():
+    global _geolocator
+    if _geolocator is None:
+        # geopy is only imported once a network lookup is actually needed
+        from geopy.geocoders import Nominatim
+
+        _geolocator = Nominatim(user_agent="streamlit_geocoder", timeout=10)
+    return _geolocator
+
+
+def nominatim_geocode(postcode, rate_limiter=None, retries=DEFAULT_RETRIES, backoff=DEFAULT_BACKOFF):
+    """
+    Geocode one postcode with Nominatim, returning (lat, lon) or (None, None)
+    when it isn't found. Timeouts are retried up to `retries` times with
+    exponential backoff; the last error is raised if they all fail.
+    """
+    from geopy.exc import GeocoderTimedOut, GeocoderUnavailable
+
+    # Errors worth retrying; anything else is reported straight away
+    retryable_errors = (GeocoderTimedOut, GeocoderUnavailable)
+    for attempt in range(retries + 1):
+        if rate_limiter is not None:
+            rate_limiter.acquire()
+        try:
+            location = get_geolocator().geocode(postcode)
+        except retryable_errors:
+            if attempt == retries:
+                raise
+            time.sleep(backoff * 2 ** attempt)
+            continue
+        if location:
+            return location.latitude, location.longitude
+        return None, None
+
+
+def geocode_many(postcodes, rate_limiter, geocode=nominatim_geocode, max_workers=DEFAULT_WORKERS):
+    """
+    Geocode postcodes concurrently under a shared rate limiter.
+
+    Yields (postcode, (lat, lon), error) as each lookup completes, so callers
+    can stream progress. `error` is None on success; failed lookups yield
+    (None, None) coordinates and the exception.
+    """
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        future_to_postcode = {
+            executor.submit(geocode, postcode, rate_limiter): postcode for postcode in postcodes
+        }
+        for future in as_completed(future_to_postcode):
+            postcode = future_to_postcode[future]
+            try:
+                yield postcode, future.result(), None
+            except Exception as e:
+                yield postcode, (None, None), e
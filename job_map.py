@@ -0,0 +1,204 @@
+import numpy as np
+import pandas as pd
+
+# folium is imported inside the functions that draw, so importing this module
+# (e.g. for MAP_MODES) stays cheap until a map is actually built
+
+
+# Map render modes offered in the sidebar
+MAP_MODES = ["Auto", "Markers", "Clustered", "Grid"]
+
+# Most locations drawn per point type in each mode; beyond that, locations are
+# merged onto a grid (coarsened until they fit) so the map HTML stays bounded
+MAX_POINTS = {"Markers": 1000, "Clustered": 10000, "Grid": 2000}
+
+# "Auto" draws one marker per location up to this many locations, then clusters
+MAX_INDIVIDUAL_MARKERS = 300
+
+# Job numbers listed in a popup before it is cut short
+MAX_POPUP_JOBS = 20
+
+# Starting grid cell size in decimal degrees of lat/lon (~1 km when merging locations, ~5 km for Grid mode)
+FINE_CELL_DEGREES = 0.01
+GRID_CELL_DEGREES = 0.05
+
+# Used when no row has coordinates
+DEFAULT_CENTER = [54.0, -2.5]
+
+# Marker styles per point type
+POINT_TYPES = {
+    "Coll": {"label": "Collection", "color": "blue", "icon": "info-sign"},
+    "Del": {"label": "Delivery", "color": "green", "icon": "flag"},
+}
+
+# Builds a marker in the browser from a compact [lat, lon, job_count, job_list, locations]
+# row; the popup HTML is only put together when it is opened
+_CLUSTER_CALLBACK = """
+function (row) {
+    var icon = L.AwesomeMarkers.icon({icon: '%(icon)s', markerColor: '%(color)s', prefix: 'glyphicon'});
+    var marker = L.marker(new L.LatLng(row[0], row[1]), {icon: icon});
+    marker.bindTooltip(row[4] > 1
+        ? '%(label)s Area - ' + row[2] + ' Jobs at ' + row[4] + ' locations'
+        : '%(label)s Point - ' + row[2] + ' Jobs');
+    marker.bindPopup(function () {
+        var hidden = row[2] - %(max_jobs)d;
+        return '<b>Total Jobs:</b> ' + row[2] + '<br>'
+            + '<b>Job Numbers:</b> ' + row[3] + (hidden > 0 ? ' and ' + hidden + ' more' : '') + '<br>'
+            + '<b>Type:</b> %(label)s';
+    });
+    return marker;
+};
+"""
+
+
+def _cell_ids(points, cell_degrees):
+    """Number each distinct location, or each grid cell of `cell_degrees` if given."""
+    if cell_degrees:
+        keys = [np.floor(points["lat"] / cell_degrees), np.floor(points["lon"] / cell_degrees)]
+    else:
+        keys = [points["lat"], points["lon"]]
+    return points.groupby(keys, sort=False).ngroup()
+
+
+def aggregate_points(data, prefix, cell_degrees=None, max_points=None):
+    """
+    Group jobs by collection ("Coll") or delivery ("Del") location.
+
+    Returns one row per location with lat, lon, job_count, a job_list of
+    at most MAX_POPUP_JOBS job numbers and the number of distinct locations
+    it stands for. With `cell_degrees`, locations are snapped to a grid of
+    that size and each cell is placed at the mean position of its jobs. If
+    there are more than `max_points` rows, the grid is made coarser until they fit.
+    """
+    points = pd.DataFrame({
+        "lat": pd.to_numeric(data[f"{prefix}Lat"], errors="coerce"),
+        "lon": pd.to_numeric(data[f"{prefix}Lon"], errors="coerce"),
+        "job": data["JobNumber"].astype(str),
+    }).dropna(subset=["lat", "lon"])
+
+    cells = _cell_ids(points, cell_degrees)
+    if max_points:
+        cell_degrees = cell_degrees or FINE_CELL_DEGREES / 2
+        while len(cells) and cells.max() >= max_points:
+            cell_degrees *= 2
+            cells = _cell_ids(points, cell_degrees)
+    points["cell"] = cells
+    points["location"] = _cell_ids(points, None)
+
+    grouped = points.groupby("cell")
+    summary = grouped.agg(
+        lat=("lat", "mean"), lon=("lon", "mean"), job_count=("job", "size"), locations=("location", "nunique")
+    )
+    summary["job_list"] = grouped.head(MAX_POPUP_JOBS).groupby("cell")["job"].agg(", ".join)
+    return summary.reset_index(drop=True)
+
+
+def _popups(points, label):
+    """Popup HTML per aggregated location, noting how many job numbers were left out."""
+    hidden = points["job_count"] - MAX_POPUP_JOBS
+    more = np.where(hidden > 0, " and " + hidden.astype(str) + " more", "")
+    return (
+        "<b>Total Jobs:</b> " + points["job_count"].astype(str) + "<br>"
+        + "<b>Job Numbers:</b> " + points["job_list"] + more + "<br>"
+        + f"<b>Type:</b> {label}"
+    )
+
+
+def _add_markers(folium_map, points, style):
+    import folium
+
+    popups = _popups(points, style["label"])
+    for lat, lon, popup, job_count, locations in zip(
+        points["lat"], points["lon"], popups, points["job_count"], points["locations"]
+    ):
+        # Past MAX_POINTS, nearby locations share a marker; say so rather than calling it a point
+        if locations > 1:
+            tooltip = f"{style['label']} Area - {job_count} Jobs at {locations} locations"
+        else:
+            tooltip = f"{style['label']} Point - {job_count} Jobs"
+        folium.Marker(
+            location=[lat, lon],
+            popup=popup,
+            tooltip=tooltip,
+            icon=folium.Icon(color=style["color"], icon=style["icon"]),
+        ).add_to(folium_map)
+
+
+def _add_cluster(folium_map, points, style):
+    from folium.plugins import FastMarkerCluster
+
+    # One compact row per location; markers, clusters and popups are built in the browser
+    rows = points[["lat", "lon", "job_count", "job_list", "locations"]].values.tolist()
+    callback = _CLUSTER_CALLBACK % {**style, "max_jobs": MAX_POPUP_JOBS}
+    FastMarkerCluster(rows, callback=callback, name=f"{style['label']} Points").add_to(folium_map)
+
+
+def _add_grid(folium_map, points, style):
+    import folium
+
+    # All cells go into one GeoJSON layer; circle area is proportional to the job count
+    features = pd.DataFrame({
+        "lon": points["lon"],
+        "lat": points["lat"],
+        "radius": (4 + 3 * np.sqrt(points["job_count"])).round(1),
+        "popup": _popups(points, style["label"]),
+        "tooltip": f"{style['label']} Area - " + points["job_count"].astype(str) + " Jobs",
+    })
+    geojson = {
+        "type": "FeatureCollection",
+        "features": [
+            {
+                "type": "Feature",
+                "geometry": {"type": "Point", "coordinates": [lon, lat]},
+                "properties": {"radius": radius, "popup": popup, "tooltip": tooltip},
+            }
+            for lon, lat, radius, popup, tooltip in features.itertuples(index=False)
+        ],
+    }
+    folium.GeoJson(
+        geojson,
+        name=f"{style['label']} Areas",
+        marker=folium.CircleMarker(color=style["color"], fill=True, fill_opacity=0.5),
+        style_function=lambda feature: {"radius": feature["properties"]["radius"]},
+        popup=folium.GeoJsonPopup(fields=["popup"], labels=False),
+        tooltip=folium.GeoJsonTooltip(fields=["tooltip"], labels=False),
+    ).add_to(folium_map)
+
+
+def create_folium_map(data, mode="Auto"):
+    """
+    Generate a Folium map with markers for collection and delivery points.
+    Combines markers with the same location into a single marker and adds job count.
+
+    `mode` is one of MAP_MODES: "Markers" draws a marker per location,
+    "Clustered" clusters locations in the browser, "Grid" aggregates
+    locations into grid cells on the server and "Auto" picks Markers or
+    Clustered by location count. Markers and Clustered draw at most
+    MAX_POINTS[mode] markers per point type; past that, nearby locations are
+    merged and their markers labelled as areas with a location count.
+    """
+    import folium
+
+    # Define a default center and zoom for the map
+    center_lat = pd.to_numeric(data["CollLat"], errors="coerce").mean()
+    center_lon = pd.to_numeric(data["CollLon"], errors="coerce").mean()
+    map_center = DEFAULT_CENTER if pd.isna(center_lat) else [center_lat, center_lon]
+    map_zoom = 9
+
+    # Create the map
+    folium_map = folium.Map(location=map_center, zoom_start=map_zoom)
+
+    if mode == "Auto":
+        locations = sum(
+            len(data[[f"{prefix}Lat", f"{prefix}Lon"]].dropna().drop_duplicates()) for prefix in POINT_TYPES
+        )
+        mode = "Markers" if locations <= MAX_INDIVIDUAL_MARKERS else "Clustered"
+
+    cell_degrees = GRID_CELL_DEGREES if mode == "Grid" else None
+    add_layer = {"Markers": _add_markers, "Clustered": _add_cluster, "Grid": _add_grid}[mode]
+    for prefix, style in POINT_TYPES.items():
+        points = aggregate_points(data, prefix, cell_degrees, max_points=MAX_POINTS[mode])
+        if len(points):
+            add_layer(folium_map, points, style)
+
+    return folium_map
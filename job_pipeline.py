@@ -0,0 +1,683 @@
+import contextvars
+import functools
+import io
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from filter_index import DATE_COLUMNS, RANGE_COLUMNS, FilterIndex
+from geocoding import geocode_many, nominatim_geocode
+from pipeline_metrics import stage
+from spatial_index import haversine_miles
+
+
+# Postcode area -> region lookup table
+POSTCODE_REGIONS_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "postcode_regions.csv")
+
+# Region given to postcodes whose area isn't in the lookup table
+UNKNOWN_REGION = "Unknown"
+
+# Distance validation: reported road distances (miles) are expected to lie between
+# MIN_ROAD_RATIO and MAX_ROAD_RATIO times the straight-line distance, give or take the slack
+MIN_ROAD_RATIO = 1.0
+MAX_ROAD_RATIO = 3.0
+DISTANCE_SLACK_MILES = 5.0
+
+# DistanceFlag values
+DISTANCE_OK = "OK"
+DISTANCE_TOO_SHORT = "Shorter Than Straight Line"
+DISTANCE_TOO_LONG = "Too Long"
+DISTANCE_FILLED = "Filled From Coordinates"
+DISTANCE_COMPUTED = "Computed From Coordinates"
+DISTANCE_UNCHECKED = "Unchecked (No Coordinates)"
+DISTANCE_NO_COORDINATES = "Missing (No Coordinates)"
+DISTANCE_FLAGS = [
+    DISTANCE_OK, DISTANCE_TOO_SHORT, DISTANCE_TOO_LONG, DISTANCE_FILLED,
+    DISTANCE_COMPUTED, DISTANCE_UNCHECKED, DISTANCE_NO_COORDINATES,
+]
+
+# Date formats accepted in the date columns, tried in order (day first, as in UK exports);
+# values matching none of them are parsed one by one, day first unless they start with the year
+DATE_INPUT_FORMATS = [
+    '%d/%m/%Y', '%d/%m/%Y %H:%M', '%d/%m/%Y %H:%M:%S', '%d/%m/%y', '%d-%m-%Y',
+    '%Y-%m-%d', '%Y-%m-%d %H:%M', '%Y-%m-%d %H:%M:%S', '%Y-%m-%dT%H:%M:%S',
+]
+
+# Columns read by the chunked CSV reader, with explicit dtypes (Distance is parsed after reading)
+JOB_DTYPES = {
+    'JobNumber': str, 'CollPostCode': str, 'DelPostCode': str, 'CustName': str, 'DelType': str,
+    'CustRef3': str, 'StartDate': str, 'EndDate': str, 'AgreedDate': str, 'Distance': str,
+}
+
+# Low-cardinality text columns stored as categoricals by the chunked reader
+CATEGORY_COLUMNS = ['CustName', 'DelType']
+
+# Rows per chunk for the chunked CSV reader
+DEFAULT_CHUNKSIZE = 50_000
+
+# Network geocode results are written to the store in batches of this many,
+# so an interrupted run keeps what it has already looked up
+STORE_BATCH_SIZE = 25
+
+# CSV uploads at least this big go through the chunked reader
+CHUNKED_CSV_BYTES = 50 * 1024 * 1024
+
+# Parquet copies of Excel uploads, keyed by file hash (override with BCA_COLUMNAR_CACHE)
+COLUMNAR_CACHE_DIR = os.environ.get(
+    "BCA_COLUMNAR_CACHE",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "columnar_cache"),
+)
+
+# Size the columnar cache is pruned back to, least recently used first (override with BCA_COLUMNAR_CACHE_MB)
+COLUMNAR_CACHE_MAX_BYTES = int(float(os.environ.get("BCA_COLUMNAR_CACHE_MB", "500")) * 1024 * 1024)
+
+# Temp files older than this (seconds) are left over from a crashed write
+STALE_TEMP_SECONDS = 3600
+
+# Upload formats read by read_jobs
+UPLOAD_TYPES = ["xlsx", "csv", "parquet", "arrow", "feather"]
+
+# Export formats and their MIME types
+EXPORT_FORMATS = {"csv": "text/csv", "parquet": "application/vnd.apache.parquet"}
+
+
+@functools.lru_cache(maxsize=None)
+def load_postcode_regions(path=POSTCODE_REGIONS_PATH):
+    """Load the postcode area -> region table as a Series indexed by area."""
+    regions = pd.read_csv(path, dtype=str, keep_default_na=False)
+    duplicated = regions["area"][regions["area"].duplicated()].tolist()
+    if duplicated:
+        raise ValueError(f"Duplicate postcode areas in {path}: {', '.join(duplicated)}")
+    return regions.set_index("area")["region"]
+
+
+def read_jobs(file_bytes, file_name):
+    """Read an uploaded Excel, CSV, Parquet or Arrow IPC job export from its raw bytes."""
+    with stage("read") as record:
+        if file_name.endswith('.xlsx'):
+            data = pd.read_excel(io.BytesIO(file_bytes))
+        elif file_name.endswith('.parquet'):
+            data = pd.read_parquet(io.BytesIO(file_bytes))
+        elif file_name.endswith(('.arrow', '.feather')):
+            data = pd.read_feather(io.BytesIO(file_bytes))
+        else:
+            data = pd.read_csv(io.BytesIO(file_bytes))
+        record["rows_out"] = len(data)
+    return data
+
+
+def prune_columnar_cache(cache_dir=COLUMNAR_CACHE_DIR, max_bytes=COLUMNAR_CACHE_MAX_BYTES):
+    """
+    Delete the least recently used Parquet copies until the cache fits in
+    `max_bytes`, along with temp files abandoned by crashed writes.
+    """
+    entries = []
+    now = time.time()
+    with os.scandir(cache_dir) as scan:
+        for entry in scan:
+            try:
+                info = entry.stat()
+                if entry.name.endswith('.tmp'):
+                    if now - info.st_mtime > STALE_TEMP_SECONDS:
+                        os.remove(entry.path)
+                elif entry.name.endswith('.parquet'):
+                    entries.append((info.st_mtime, info.st_size, entry.path))
+            except OSError:
+                pass  # Removed by another process in the meantime
+
+    total = sum(size for _, size, _ in entries)
+    for _, size, path in sorted(entries):
+        if total <= max_bytes:
+            break
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+        total -= size
+
+
+def read_jobs_cached(file_bytes, file_name, file_hash, cache_dir=COLUMNAR_CACHE_DIR):
+    """
+    Like read_jobs, but an Excel export is converted to Parquet on first read
+    (keyed by `file_hash`) and read back from there afterwards. The cache is
+    kept under COLUMNAR_CACHE_MAX_BYTES by dropping the least recently read copies.
+    """
+    if not file_name.endswith('.xlsx'):
+        return read_jobs(file_bytes, file_name)
+
+    cache_path = os.path.join(cache_dir, f"{file_hash}.parquet")
+    if os.path.exists(cache_path):
+        with stage("read (columnar cache)") as record:
+            data = pd.read_parquet(cache_path)
+            record["rows_out"] = len(data)
+        try:
+            os.utime(cache_path)  # Mark as recently used for pruning
+        except OSError:
+            pass
+        return data
+
+    data = fix_mixed_types(read_jobs(file_bytes, file_name))
+    # Write then rename so other processes never see a partial file
+    temp_path = f"{cache_path}.{os.getpid()}.tmp"
+    try:
+        os.makedirs(cache_dir, exist_ok=True)
+        data.to_parquet(temp_path, index=False)
+        os.replace(temp_path, cache_path)
+        prune_columnar_cache(cache_dir)
+    except (OSError, ValueError, TypeError, ImportError):
+        # The cache is only an optimization; just don't leave a partial file behind
+        try:
+            os.remove(temp_path)
+        except OSError:
+            pass
+    return data
+
+
+def export_jobs(data, export_format):
+    """Serialize jobs to CSV or Parquet in a single in-memory buffer, ready to read."""
+    buffer = io.BytesIO()
+    if export_format == 'parquet':
+        data.to_parquet(buffer, index=False)
+    else:
+        data.to_csv(buffer, index=False)
+    buffer.seek(0)
+    return buffer
+
+
+def fix_mixed_types(data):
+    """
+    Convert object columns, which usually hold mixed types, to strings.
+    Frames with none (e.g. read back from the columnar cache, which stores
+    converted data) are returned as they are.
+    """
+    # Mixed-type columns are usually 'object'
+    mixed = [column for column in data.columns if data[column].dtype == 'object']
+    if not mixed:
+        return data
+    with stage("type cleanup", rows_in=len(data)) as record:
+        for column in mixed:
+            data[column] = data[column].astype(str)  # Convert everything to string
+        record["rows_out"] = len(data)
+    return data
+
+
+def clean_jobs(data, unreadable=None):
+    """Fix mixed types, job numbers, dates and postcodes in a raw job export (see normalize_jobs)."""
+    return normalize_jobs(fix_mixed_types(data), unreadable)
+
+
+def parse_dates(values):
+    """
+    Parse a date column against the fixed DATE_INPUT_FORMATS, then parse
+    what's left value by value (day first, or as ISO 8601 when it starts
+    with the year), so a date reads the same whichever rows (or chunk) it is
+    parsed with. Unparseable values become NaT.
+    """
+    if pd.api.types.is_datetime64_any_dtype(values):
+        return values
+    text = values.where(values.isna(), values.astype(str).str.strip())
+    parsed = pd.Series(pd.NaT, index=values.index, dtype='datetime64[ns]')
+    for date_format in DATE_INPUT_FORMATS:
+        pending = parsed.isna() & text.notna()
+        if not pending.any():
+            return parsed
+        parsed[pending] = pd.to_datetime(text[pending], format=date_format, errors='coerce')
+
+    pending = parsed.isna() & text.notna() & (text != '')
+    if pending.any():
+        year_first = pending & text.str.match(r'\d{4}-', na=False)
+        if year_first.any():
+            iso = pd.to_datetime(text[year_first], format='ISO8601', errors='coerce', utc=True)
+            parsed[year_first] = iso.dt.tz_localize(None)
+        day_first = pending & ~year_first
+        if day_first.any():
+            parsed[day_first] = pd.to_datetime(text[day_first], format='mixed', dayfirst=True, errors='coerce')
+    return parsed
+
+
+def unreadable_dates(values, parsed):
+    """How many non-blank values of a date column didn't parse."""
+    if pd.api.types.is_datetime64_any_dtype(values):
+        return 0
+    return int((values.notna() & (values.astype(str).str.strip() != '') & parsed.isna()).sum())
+
+
+def normalize_jobs(data, unreadable=None):
+    """
+    Fix job numbers, dates and postcodes (columns already read as strings).
+    Dates that can't be read are left blank; with an `unreadable` dict, their
+    count per column is added to it.
+    """
+    with stage("field cleanup", rows_in=len(data)) as record:
+        # **Fix Comma Handling in Columns (e.g., JobNumber)**
+        data['JobNumber'] = data['JobNumber'].astype(str).str.replace(',', '')   # Remove commas from numbers
+        if 'CustRef3' in data.columns:
+            # Convert the column to string to handle mixed types
+            data['CustRef3'] = data['CustRef3'].astype(str)
+            data['CustRef3'] = data['CustRef3'].replace({'nan': 'N/A', 'None': 'N/A', '': 'N/A'}).fillna('N/A')
+
+        # Clean and standardize postcodes (same normalization as the geocode store keys)
+        data['CollPostCode'] = data['CollPostCode'].str.strip().str.upper().str.replace(r'\s+', ' ', regex=True)
+        data['DelPostCode'] = data['DelPostCode'].str.strip().str.upper().str.replace(r'\s+', ' ', regex=True)
+        record["rows_out"] = len(data)
+
+    # **Fix Date Columns (Optional)**
+    with stage("date parsing", rows_in=len(data)) as record:
+        for col in DATE_COLUMNS:
+            if col in data.columns:
+                parsed = parse_dates(data[col])
+                if unreadable is not None:
+                    unreadable[col] = unreadable.get(col, 0) + unreadable_dates(data[col], parsed)
+                data[col] = parsed.dt.strftime('%d/%m/%Y')
+        record["rows_out"] = len(data)
+
+    return data
+
+
+def unique_postcodes(data):
+    """Deduplicate collection and delivery postcodes to minimize geocoding requests."""
+    return pd.concat([data['CollPostCode'], data['DelPostCode']]).dropna().unique()
+
+
+def geocode_postcodes(postcodes, rate_limiter, centroid_geocoder=None, store=None, on_progress=None, known=None,
+                      geocode=nominatim_geocode, service=None):
+    """
+    Resolve postcodes offline first, then from the persistent store, and only
+    send the leftovers to the network geocoder. Postcodes in `known` (a dict
+    of postcode -> (lat, lon) already resolved, e.g. from a previous upload)
+    are taken as they are. `geocode(postcode, rate_limiter)` is the network
+    lookup (Nominatim unless a stand-in is given). With a GeocodeService as
+    `service`, network lookups go through its shared queue instead, under
+    its rate limit, and `rate_limiter` and `geocode` are not used.
+
+    `on_progress(done, total)` is called as each network lookup completes.
+    Returns (geocode_dict, report) where report counts the postcodes
+    resolved from the previous upload ("previous"), the offline dataset
+    ("offline") and the store ("stored"), their total ("cached"), and lists
+    the postcodes that were fetched or failed.
+    """
+    geocode_dict = {}
+    pending = list(postcodes)
+    report = {"cached": 0, "previous": 0, "offline": 0, "stored": 0, "fetched": [], "failed": []}
+
+    if known:
+        with stage("geocode (previous upload)", rows_in=len(pending)) as record:
+            geocode_dict.update((postcode, known[postcode]) for postcode in pending if postcode in known)
+            pending = [postcode for postcode in pending if postcode not in geocode_dict]
+            report["previous"] = record["rows_out"] = len(geocode_dict)
+
+    # Resolve everything we can from the offline centroid dataset in one vectorized lookup
+    if centroid_geocoder is not None and pending:
+        with stage("geocode (offline centroids)", rows_in=len(pending)) as record:
+            offline = centroid_geocoder.lookup(pending).dropna(subset=["lat"])
+            geocode_dict.update(zip(offline["postcode"], zip(offline["lat"], offline["lon"])))
+            pending = [postcode for postcode in pending if postcode not in geocode_dict]
+            report["offline"] = record["rows_out"] = len(offline)
+
+    # Check the persistent store in bulk before making any network call
+    if store is not None and pending:
+        with stage("geocode (store)", rows_in=len(pending)) as record:
+            cached = store.get_many(pending)
+            geocode_dict.update(cached)
+            pending = [postcode for postcode in pending if postcode not in geocode_dict]
+            report["stored"] = record["rows_out"] = len(cached)
+
+    report["cached"] = len(geocode_dict)
+
+    # Geocode the rest concurrently, reporting progress as each one completes
+    geocoded_results = []
+    if pending:
+        with stage("geocode (network)", rows_in=len(pending)) as record:
+            if service is not None:
+                lookups = service.geocode_many(pending)
+            else:
+                lookups = geocode_many(pending, rate_limiter, geocode=geocode)
+            # Persist new results (misses included, failures excluded) for later sessions
+            # as they arrive, flushing the rest even if the run is stopped part way
+            stored = 0
+            try:
+                for idx, (postcode, coords, error) in enumerate(lookups):
+                    if error is None:
+                        geocoded_results.append((postcode, coords))
+                        report["fetched"].append(postcode)
+                    else:
+                        report["failed"].append(postcode)
+                    if store is not None and len(geocoded_results) - stored >= STORE_BATCH_SIZE:
+                        store.put_many(geocoded_results[stored:])
+                        stored = len(geocoded_results)
+                    if on_progress is not None:
+                        on_progress(idx + 1, len(pending))
+            finally:
+                if store is not None:
+                    store.put_many(geocoded_results[stored:])
+            record["rows_out"] = len(geocoded_results)
+
+    geocode_dict.update(geocoded_results)
+    return geocode_dict, report
+
+
+def build_postcode_lookup(postcodes, geocode_dict):
+    """
+    Build the per-postcode lookup table (lat, lon, outward code, region)
+    for an array of unique postcodes, vectorized over the unique postcodes
+    rather than the job rows.
+    """
+    postcodes = pd.Index(postcodes, dtype=object)
+    coords = pd.DataFrame.from_dict(geocode_dict, orient="index", columns=["lat", "lon"])
+    coords = coords.reindex(postcodes).astype("float64")
+
+    # Letters before the first number, e.g. "SW" for "SW1A 1AA"
+    outward = pd.Series(postcodes, index=postcodes, dtype=object).str.extract(r"^([A-Z]+)", expand=False)
+    regions = load_postcode_regions()
+    region = outward.map(regions).fillna(UNKNOWN_REGION)
+
+    return pd.DataFrame({
+        "lat": coords["lat"],
+        "lon": coords["lon"],
+        "outward": pd.Categorical(outward),
+        "region": pd.Categorical(region, categories=list(dict.fromkeys([*regions, UNKNOWN_REGION]))),
+    }, index=postcodes)
+
+
+def tag_jobs(data, geocode_dict):
+    """
+    Add coordinate, outward code and region columns for collection and
+    delivery postcodes with one lookup against the unique-postcode table.
+    Outward codes and regions are stored as categoricals.
+    """
+    with stage("region tagging", rows_in=len(data)) as record:
+        # Encode both postcode columns against one shared set of categories
+        postcodes = pd.Categorical(pd.concat([data['CollPostCode'], data['DelPostCode']], ignore_index=True))
+        lookup = build_postcode_lookup(postcodes.categories, geocode_dict)
+        outward_categories = lookup["outward"].cat.categories
+        region_categories = lookup["region"].cat.categories
+
+        # Lookup columns as arrays, with an extra last entry picked by code -1 (missing postcode)
+        lat = np.append(lookup["lat"].to_numpy(), np.nan)
+        lon = np.append(lookup["lon"].to_numpy(), np.nan)
+        outward_codes = np.append(lookup["outward"].cat.codes.to_numpy(), -1)
+        region_codes = np.append(lookup["region"].cat.codes.to_numpy(), region_categories.get_loc(UNKNOWN_REGION))
+
+        coll_codes = postcodes.codes[:len(data)]
+        del_codes = postcodes.codes[len(data):]
+
+        # Add latitude and longitude columns to the dataset
+        data['CollLat'], data['CollLon'] = lat[coll_codes], lon[coll_codes]
+        data['DelLat'], data['DelLon'] = lat[del_codes], lon[del_codes]
+
+        # Outward codes and regions for collection and delivery postcodes
+        data['CollOutwardCode'] = pd.Categorical.from_codes(outward_codes[coll_codes], categories=outward_categories)
+        data['DelOutwardCode'] = pd.Categorical.from_codes(outward_codes[del_codes], categories=outward_categories)
+        data['CollRegion'] = pd.Categorical.from_codes(region_codes[coll_codes], categories=region_categories)
+        data['DelRegion'] = pd.Categorical.from_codes(region_codes[del_codes], categories=region_categories)
+        record["rows_out"] = len(data)
+    return data
+
+
+def add_distances(data):
+    """
+    Compute the straight-line collection-to-delivery distance for every row
+    and use it to validate the uploaded Distance column.
+
+    Adds StraightDistance (miles) and DistanceFlag. A missing or non-numeric
+    Distance is filled from the straight-line distance ("Filled"); a file
+    without a Distance column gets one ("Computed"). Reported distances
+    shorter than the straight line, or far longer than any road route, are
+    flagged as outliers but left as reported.
+    """
+    with stage("distances", rows_in=len(data)) as record:
+        straight = haversine_miles(data['CollLat'], data['CollLon'], data['DelLat'], data['DelLon'])
+        data['StraightDistance'] = np.round(straight, 1)
+        no_coordinates = np.isnan(straight)
+
+        flag = DISTANCE_FLAGS.index
+        if 'Distance' not in data.columns:
+            data['Distance'] = data['StraightDistance']
+            codes = np.where(no_coordinates, flag(DISTANCE_NO_COORDINATES), flag(DISTANCE_COMPUTED))
+        else:
+            reported = pd.to_numeric(data['Distance'], errors='coerce').to_numpy(dtype='float64')
+            missing = np.isnan(reported)
+            too_short = reported < straight * MIN_ROAD_RATIO - DISTANCE_SLACK_MILES
+            too_long = reported > straight * MAX_ROAD_RATIO + DISTANCE_SLACK_MILES
+            data['Distance'] = np.where(missing, data['StraightDistance'], reported)
+            # Flag codes, first matching condition wins
+            codes = np.select(
+                [missing & no_coordinates, missing, no_coordinates, too_short, too_long],
+                [flag(DISTANCE_NO_COORDINATES), flag(DISTANCE_FILLED), flag(DISTANCE_UNCHECKED),
+                 flag(DISTANCE_TOO_SHORT), flag(DISTANCE_TOO_LONG)],
+                default=flag(DISTANCE_OK),
+            )
+
+        data['DistanceFlag'] = pd.Categorical.from_codes(codes, categories=DISTANCE_FLAGS)
+        record["rows_out"] = len(data)
+    return data
+
+
+def enrich_jobs(data, rate_limiter, centroid_geocoder=None, store=None, on_progress=None, known=None,
+                geocode=nominatim_geocode, service=None):
+    """
+    Clean, geocode and region-tag a raw job export. Returns (data, geocode_report);
+    the report's "unreadable_dates" counts dates left blank per column.
+    """
+    unreadable = {}
+    data = clean_jobs(data, unreadable)
+    geocode_dict, geocode_report = geocode_postcodes(
+        unique_postcodes(data),
+        rate_limiter,
+        centroid_geocoder=centroid_geocoder,
+        store=store,
+        on_progress=on_progress,
+        known=known,
+        geocode=geocode,
+        service=service,
+    )
+    geocode_report["unreadable_dates"] = unreadable
+    return add_distances(tag_jobs(data, geocode_dict)), geocode_report
+
+
+def job_keys(raw):
+    """
+    Key identifying each row of a raw export across uploads: the JobNumber
+    (thousands separators removed) plus its occurrence count, so repeated
+    job numbers still get distinct keys.
+    """
+    numbers = raw['JobNumber'].astype(str).str.replace(',', '', regex=False)
+    return (numbers + '#' + numbers.groupby(numbers).cumcount().astype(str)).to_numpy(dtype=object)
+
+
+def snapshot_rows(raw):
+    """
+    What an incremental refresh needs to remember about a raw export: the
+    row keys, a content hash per row and the column layout.
+    """
+    return {
+        "keys": job_keys(raw),
+        "hashes": pd.util.hash_pandas_object(raw, index=False).to_numpy(),
+        "columns": {column: str(dtype) for column, dtype in raw.dtypes.items()},
+    }
+
+
+def known_coordinates(data):
+    """
+    Postcode -> (lat, lon) for the postcodes of an enriched frame that were
+    resolved. Misses and failed lookups are left out, so they go back through
+    the store (which expires cached misses) and the network.
+    """
+    coords = pd.concat([
+        pd.DataFrame({"postcode": data['CollPostCode'], "lat": data['CollLat'], "lon": data['CollLon']}),
+        pd.DataFrame({"postcode": data['DelPostCode'], "lat": data['DelLat'], "lon": data['DelLon']}),
+    ], ignore_index=True).dropna(subset=["postcode", "lat", "lon"]).drop_duplicates("postcode")
+    return dict(zip(coords["postcode"], zip(coords["lat"], coords["lon"])))
+
+
+def enrich_jobs_incremental(raw, previous, rate_limiter, centroid_geocoder=None, store=None, on_progress=None,
+                            geocode=nominatim_geocode, service=None):
+    """
+    Enrich a re-upload by reusing the rows it shares with the previous one.
+
+    `previous` is (data, rows) from the last upload: its enriched frame and
+    the snapshot_rows() of its raw export. Rows are matched on job_keys();
+    those whose raw content is unchanged and were located are copied from the
+    previous frame. New or changed rows, and rows whose postcodes weren't
+    resolved, go through the pipeline, with postcodes the previous upload
+    resolved taken from it. Jobs missing from the new
+    file are dropped. Falls back to a full run when there is no previous
+    upload or its columns differ.
+
+    Returns (data, geocode_report, rows); the report also counts the reused
+    and processed rows.
+    """
+    with stage("incremental diff", rows_in=len(raw)):
+        rows = snapshot_rows(raw)
+    if previous is None or previous[1]["columns"] != rows["columns"]:
+        data, geocode_report = enrich_jobs(
+            raw, rate_limiter, centroid_geocoder=centroid_geocoder, store=store, on_progress=on_progress,
+            geocode=geocode, service=service,
+        )
+        geocode_report.update(reused_rows=0, processed_rows=len(data))
+        return data, geocode_report, rows
+
+    previous_data, previous_rows = previous
+    with stage("incremental diff", rows_in=len(raw)) as record:
+        previous_positions = pd.Index(previous_rows["keys"]).get_indexer(rows["keys"])
+        unchanged = previous_positions >= 0
+        unchanged[unchanged] = previous_rows["hashes"][previous_positions[unchanged]] == rows["hashes"][unchanged]
+        # Rows left without coordinates (misses or failed lookups) are looked up again
+        located = previous_data[['CollLat', 'CollLon', 'DelLat', 'DelLon']].notna().all(axis=1).to_numpy()
+        unchanged[unchanged] = located[previous_positions[unchanged]]
+        reused = np.flatnonzero(unchanged)
+        changed = np.flatnonzero(~unchanged)
+        record["rows_out"] = len(changed)
+
+    parts = [previous_data.iloc[previous_positions[reused]]]
+    geocode_report = {
+        "cached": 0, "previous": 0, "offline": 0, "stored": 0, "fetched": [], "failed": [], "unreadable_dates": {},
+    }
+    if len(changed):
+        fresh, geocode_report = enrich_jobs(
+            raw.iloc[changed].reset_index(drop=True), rate_limiter, centroid_geocoder=centroid_geocoder,
+            store=store, on_progress=on_progress, known=known_coordinates(previous_data),
+            geocode=geocode, service=service,
+        )
+        parts.append(fresh)
+
+    with stage("incremental merge", rows_in=len(raw)) as record:
+        # Put the rows back in the order of the new file
+        categorical = [
+            column for column, dtype in previous_data.dtypes.items() if isinstance(dtype, pd.CategoricalDtype)
+        ]
+        data = pd.concat(parts, ignore_index=True)
+        data = data.iloc[np.argsort(np.concatenate([reused, changed]), kind='stable')].reset_index(drop=True)
+        # Categories can differ between the reused and fresh parts, which concat turns into plain columns
+        for column in categorical:
+            if not isinstance(data[column].dtype, pd.CategoricalDtype):
+                data[column] = data[column].astype('category')
+        record["rows_out"] = len(data)
+
+    geocode_report.update(reused_rows=len(reused), processed_rows=len(changed))
+    return data, geocode_report, rows
+
+
+def filter_jobs(data, filters):
+    """
+    Apply filters given as column -> list of values or (low, high) range,
+    the same shape the app's sidebar builds, as one combined mask.
+
+    A range filter on a column with no numeric values (e.g. Distance when
+    nothing could be geocoded) matches no rows; a filter on a column the
+    data doesn't have raises ValueError.
+    """
+    with stage("filtering", rows_in=len(data)) as record:
+        filter_index = FilterIndex(data)
+        active = {}
+        for column, selection in filters.items():
+            if not selection:
+                continue
+            if column in filter_index:
+                active[column] = selection
+            elif column in RANGE_COLUMNS and column in data.columns:
+                # Range column without any values: nothing is in range
+                data = data.iloc[:0]
+                break
+            else:
+                raise ValueError(f"Can't filter on {column}: the export has no {column} column")
+        else:
+            data = data[filter_index.mask(active)]
+        record["rows_out"] = len(data)
+    return data
+
+
+def ingest_csv_chunked(source, rate_limiter, centroid_geocoder=None, store=None,
+                       chunksize=DEFAULT_CHUNKSIZE, usecols=None, on_progress=None, geocode=nominatim_geocode,
+                       service=None):
+    """
+    Read, clean, geocode and region-tag a large CSV export chunk by chunk.
+
+    Only `usecols` (default: the JOB_DTYPES columns present in the file) are
+    read, all as strings, so missing values stay NaN instead of becoming
+    'nan'. Postcodes not seen in earlier chunks are handed to a background
+    geocoder as soon as their chunk is read, so geocoding overlaps reading.
+    `on_progress(done, total)` is called per geocoded batch once reading is
+    done. Returns (data, geocode_report) like enrich_jobs.
+    """
+    if usecols is None:
+        usecols = lambda column: column in JOB_DTYPES
+
+    chunks = []
+    unreadable = {}
+    seen_postcodes = set()
+    batches = []
+
+    # One background worker so batches are geocoded in order; each batch is concurrent internally
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        reader = pd.read_csv(source, chunksize=chunksize, usecols=usecols, dtype=JOB_DTYPES)
+        while True:
+            with stage("read (chunk)") as record:
+                chunk = next(reader, None)
+                record["rows_out"] = 0 if chunk is None else len(chunk)
+            if chunk is None:
+                break
+            chunk = normalize_jobs(chunk, unreadable)
+            if 'Distance' in chunk.columns:
+                chunk['Distance'] = pd.to_numeric(chunk['Distance'], errors='coerce')
+            chunks.append(chunk)
+
+            new_postcodes = [postcode for postcode in unique_postcodes(chunk) if postcode not in seen_postcodes]
+            seen_postcodes.update(new_postcodes)
+            if new_postcodes:
+                # Run in a copy of this context so the worker's geocode stages are timed too
+                future = executor.submit(
+                    contextvars.copy_context().run, geocode_postcodes, new_postcodes, rate_limiter,
+                    centroid_geocoder=centroid_geocoder, store=store, geocode=geocode,
+                    service=service,
+                )
+                batches.append((future, len(new_postcodes)))
+
+        data = pd.concat(chunks, ignore_index=True) if chunks else pd.DataFrame(columns=list(JOB_DTYPES))
+        del chunks
+
+        geocode_dict = {}
+        geocode_report = {
+            "cached": 0, "previous": 0, "offline": 0, "stored": 0, "fetched": [], "failed": [],
+            "unreadable_dates": unreadable,
+        }
+        done = 0
+        for future, batch_size in batches:
+            batch_dict, batch_report = future.result()
+            geocode_dict.update(batch_dict)
+            for count in ("cached", "previous", "offline", "stored"):
+                geocode_report[count] += batch_report[count]
+            geocode_report["fetched"] += batch_report["fetched"]
+            geocode_report["failed"] += batch_report["failed"]
+            done += batch_size
+            if on_progress is not None:
+                on_progress(done, len(seen_postcodes))
+
+    for column in CATEGORY_COLUMNS:
+        if column in data.columns:
+            data[column] = data[column].astype('category')
+
+    return add_distances(tag_jobs(data, geocode_dict)), geocode_report
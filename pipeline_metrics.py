@@ -0,0 +1,127 @@
+import contextlib
+import contextvars
+import datetime
+import json
+import os
+import time
+import tracemalloc
+import uuid
+
+
+# JSON-lines file stage metrics are appended to (override with BCA_METRICS_LOG; set it empty to disable)
+DEFAULT_METRICS_PATH = os.environ.get(
+    "BCA_METRICS_LOG",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "pipeline_metrics.jsonl"),
+)
+
+# Size at which the metrics log is rotated to <path>.1, replacing the previous one (override with BCA_METRICS_LOG_MB)
+MAX_METRICS_BYTES = int(float(os.environ.get("BCA_METRICS_LOG_MB", "10")) * 1024 * 1024)
+
+# Release label written with every record, so runs can be compared across releases
+RELEASE = os.environ.get("BCA_RELEASE", "dev")
+
+# The PipelineMetrics that stage() records into, if any
+_current = contextvars.ContextVar("pipeline_metrics", default=None)
+
+
+def rss_mb():
+    """This process's current resident memory in MB, or None where /proc isn't available."""
+    try:
+        with open("/proc/self/statm") as statm:
+            resident_pages = int(statm.read().split()[1])
+    except (OSError, ValueError, IndexError):
+        return None
+    return resident_pages * os.sysconf("SC_PAGE_SIZE") / (1024 * 1024)
+
+
+class PipelineMetrics:
+    """
+    Per-stage timings for one pipeline run (an app rerun or a batch file).
+
+    Each stage records its wall time, rows in and out, the process's resident
+    memory when it finished and how much that changed during the stage (which,
+    in a process serving several sessions, includes their work too). When
+    tracemalloc is tracing (e.g. under PYTHONTRACEMALLOC=1), the stage's own
+    peak Python allocation is recorded as well.
+    """
+
+    def __init__(self, run=None, **context):
+        self.run = run or uuid.uuid4().hex[:12]
+        self.context = context
+        self.stages = []
+
+    @contextlib.contextmanager
+    def stage(self, name, rows_in=None):
+        """Time the enclosed block; set "rows_out" (or other fields) on the yielded record."""
+        record = {"stage": name, "rows_in": rows_in, "rows_out": None}
+        if tracemalloc.is_tracing():
+            tracemalloc.reset_peak()
+        start_rss = rss_mb()
+        start = time.perf_counter()
+        try:
+            yield record
+        finally:
+            record["seconds"] = round(time.perf_counter() - start, 4)
+            end_rss = rss_mb()
+            record["rss_mb"] = None if end_rss is None else round(end_rss, 1)
+            record["rss_delta_mb"] = None if end_rss is None or start_rss is None else round(end_rss - start_rss, 1)
+            if tracemalloc.is_tracing():
+                record["peak_alloc_mb"] = round(tracemalloc.get_traced_memory()[1] / (1024 * 1024), 1)
+            self.stages.append(record)
+
+    def records(self):
+        """Stage records tagged with the run id, release, timestamp and run context."""
+        timestamp = datetime.datetime.now(datetime.timezone.utc).isoformat(timespec="seconds")
+        return [
+            {"run": self.run, "release": RELEASE, "time": timestamp, **self.context, **stage}
+            for stage in self.stages
+        ]
+
+    def write(self, path=DEFAULT_METRICS_PATH, max_bytes=MAX_METRICS_BYTES):
+        """
+        Append this run's stage records to a JSON-lines file; does nothing
+        without a path. Once the file reaches `max_bytes` it is moved to
+        <path>.1 first, so the log takes at most about twice that.
+        """
+        if not path or not self.stages:
+            return
+        try:
+            if os.path.getsize(path) >= max_bytes:
+                os.replace(path, f"{path}.1")
+        except OSError:
+            pass  # No log yet, or another writer rotated it first
+        try:
+            with open(path, "a", encoding="utf-8") as metrics_file:
+                for record in self.records():
+                    metrics_file.write(json.dumps(record, default=str) + "\n")
+        except OSError:
+            pass  # Metrics must never break a run
+
+
+def current_metrics():
+    """The PipelineMetrics that stage() is recording into, or None."""
+    return _current.get()
+
+
+@contextlib.contextmanager
+def collecting(metrics):
+    """Make `metrics` the target of stage() calls made inside the block (and its context copies)."""
+    token = _current.set(metrics)
+    try:
+        yield metrics
+    finally:
+        _current.reset(token)
+
+
+@contextlib.contextmanager
+def stage(name, rows_in=None):
+    """
+    Time a pipeline stage into the active PipelineMetrics (see collecting).
+    Without one, the yielded record is simply discarded.
+    """
+    metrics = _current.get()
+    if metrics is None:
+        yield {}
+        return
+    with metrics.stage(name, rows_in) as record:
+        yield record
@@ -0,0 +1,128 @@
+import os
+
+import numpy as np
+import pandas as pd
+
+
+# Local postcode-centroid dataset (override with BCA_POSTCODE_CENTROIDS).
+# Any CSV with a postcode column and latitude/longitude columns works, e.g. an
+# extract of the ONS Postcode Directory (pcds, lat, long); it isn't shipped with
+# the repo, build it with build_postcode_centroids.py.
+DEFAULT_CENTROIDS_PATH = os.environ.get(
+    "BCA_POSTCODE_CENTROIDS",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "postcode_centroids.csv"),
+)
+
+# Accepted column names in the centroid dataset
+_POSTCODE_COLUMNS = ("postcode", "pcds", "pcd")
+_LAT_COLUMNS = ("lat", "latitude")
+_LON_COLUMNS = ("lon", "long", "longitude")
+
+# Outward code, optional sector digit and optional unit letters, e.g. "AB1 2CD", "AB12CD", "AB1 2", "AB1"
+_POSTCODE_PATTERN = r"^([A-Z]{1,2}[0-9][A-Z0-9]?) ?(?:([0-9])([A-Z]{2})?)?$"
+
+
+def split_postcodes(postcodes):
+    """
+    Split postcodes into full, sector and outward keys (vectorized).
+    Anything that doesn't look like a UK postcode gets NaN keys.
+    """
+    postcodes = pd.Series(postcodes, dtype=object).astype(str).str.upper().str.replace(r"\s+", "", regex=True)
+    parts = postcodes.str.extract(_POSTCODE_PATTERN)
+    outward, sector_digit, unit = parts[0], parts[1], parts[2]
+
+    sector = outward + " " + sector_digit
+    full = sector + unit
+    return pd.DataFrame({"full": full, "sector": sector, "outward": outward})
+
+
+def _pick_column(columns, candidates, what):
+    lookup = {column.lower(): column for column in columns}
+    for candidate in candidates:
+        if candidate in lookup:
+            return lookup[candidate]
+    raise ValueError(f"Centroid dataset has no {what} column (expected one of {', '.join(candidates)})")
+
+
+class CentroidGeocoder:
+    """
+    Offline geocoder answering from a postcode-centroid dataset.
+
+    The dataset is indexed once by full postcode, and averaged into sector
+    ("AB1 2") and outward ("AB1") centroids so partial or unknown postcodes
+    still get an approximate location.
+    """
+
+    def __init__(self, centroids):
+        keys = split_postcodes(centroids["postcode"])
+        centroids = pd.DataFrame({
+            "full": keys["full"].to_numpy(),
+            "sector": keys["sector"].to_numpy(),
+            "outward": keys["outward"].to_numpy(),
+            "lat": pd.to_numeric(centroids["lat"], errors="coerce").to_numpy(),
+            "lon": pd.to_numeric(centroids["lon"], errors="coerce").to_numpy(),
+        }).dropna(subset=["outward", "lat", "lon"])
+
+        # One lookup table per level, most precise first
+        self.levels = []
+        for level in ("full", "sector", "outward"):
+            table = centroids.dropna(subset=[level]).groupby(level)[["lat", "lon"]].mean()
+            self.levels.append((level, table.index, table["lat"].to_numpy(), table["lon"].to_numpy()))
+
+    @classmethod
+    def from_csv(cls, path=DEFAULT_CENTROIDS_PATH):
+        header = pd.read_csv(path, nrows=0).columns
+        postcode_col = _pick_column(header, _POSTCODE_COLUMNS, "postcode")
+        lat_col = _pick_column(header, _LAT_COLUMNS, "latitude")
+        lon_col = _pick_column(header, _LON_COLUMNS, "longitude")
+        centroids = pd.read_csv(
+            path,
+            usecols=[postcode_col, lat_col, lon_col],
+            dtype={postcode_col: str, lat_col: "float64", lon_col: "float64"},
+        )
+        return cls(centroids.rename(columns={postcode_col: "postcode", lat_col: "lat", lon_col: "lon"}))
+
+    def __len__(self):
+        return len(self.levels[0][1])
+
+    def lookup(self, postcodes):
+        """
+        Geocode an array of postcodes in one pass.
+
+        Returns a DataFrame aligned with `postcodes` with lat, lon and the
+        level that matched ("full", "sector", "outward"); unmatched rows have
+        NaN coordinates and no level.
+        """
+        keys = split_postcodes(postcodes)
+        lat = np.full(len(keys), np.nan)
+        lon = np.full(len(keys), np.nan)
+        matched_level = np.full(len(keys), None, dtype=object)
+
+        for level, index, level_lat, level_lon in self.levels:
+            pending = np.isnan(lat)
+            if not pending.any():
+                break
+            positions = np.full(len(keys), -1)
+            positions[pending] = index.get_indexer(keys[level].to_numpy()[pending])
+            found = positions >= 0
+            lat[found] = level_lat[positions[found]]
+            lon[found] = level_lon[positions[found]]
+            matched_level[found] = level
+
+        return pd.DataFrame(
+            {"postcode": np.asarray(postcodes, dtype=object), "lat": lat, "lon": lon, "level": matched_level}
+        )
+
+    def geocode(self, postcode):
+        """Geocode a single postcode, returning (lat, lon) or (None, None)."""
+        result = self.lookup([postcode]).iloc[0]
+        if pd.isna(result["lat"]):
+            return None, None
+        return float(result["lat"]), float(result["lon"])
+
+
+def load_centroid_geocoder(path=DEFAULT_CENTROIDS_PATH):
+    """Load the centroid geocoder, or return None if no dataset is installed."""
+    if not os.path.exists(path):
+        return None
+    return CentroidGeocoder.from_csv(path)
@@ -0,0 +1,98 @@
+import numpy as np
+import pandas as pd
+
+
+EARTH_RADIUS_MILES = 3958.8
+
+# Grid cell size in degrees (~7 miles north-south)
+DEFAULT_CELL_DEGREES = 0.1
+
+# Miles per degree of latitude
+_MILES_PER_DEGREE = EARTH_RADIUS_MILES * np.pi / 180
+
+# Keeps (lat cell, lon cell) pairs unique when packed into one integer key
+_KEY_STRIDE = 1 << 20
+
+
+def haversine_miles(lat1, lon1, lat2, lon2):
+    """Great-circle distance in miles between points given in degrees (vectorized)."""
+    lat1, lon1, lat2, lon2 = (np.radians(np.asarray(values, dtype='float64')) for values in (lat1, lon1, lat2, lon2))
+    a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS_MILES * np.arcsin(np.sqrt(np.clip(a, 0, 1)))
+
+
+class SpatialIndex:
+    """
+    Grid index over a set of lat/lon points for radius queries.
+
+    Points are bucketed into cells of `cell_degrees` and sorted by cell, so a
+    query only measures exact haversine distances to points in the cells
+    overlapping the search circle's bounding box. Points without coordinates
+    are never returned.
+    """
+
+    def __init__(self, lat, lon, cell_degrees=DEFAULT_CELL_DEGREES):
+        self.cell_degrees = cell_degrees
+        self.lat = pd.to_numeric(pd.Series(lat), errors='coerce').to_numpy(dtype='float64')
+        self.lon = pd.to_numeric(pd.Series(lon), errors='coerce').to_numpy(dtype='float64')
+        self.n_rows = len(self.lat)
+
+        valid = np.flatnonzero(~(np.isnan(self.lat) | np.isnan(self.lon)))
+        keys = self._cell_keys(self._cell(self.lat[valid]), self._cell(self.lon[valid]))
+        order = np.argsort(keys, kind='stable')
+        self.positions = valid[order]
+        self.sorted_keys = keys[order]
+
+    def _cell(self, degrees):
+        return np.floor(np.asarray(degrees) / self.cell_degrees).astype('int64')
+
+    @staticmethod
+    def _cell_keys(lat_cells, lon_cells):
+        return lat_cells * _KEY_STRIDE + lon_cells
+
+    def candidates(self, lat, lon, miles):
+        """Positions of points in the grid cells overlapping the circle's bounding box."""
+        lat_span = miles / _MILES_PER_DEGREE
+        # Longitude degrees shrink towards the poles; use the widest latitude in the box
+        widest = min(abs(lat) + lat_span, 89.9)
+        lon_span = miles / (_MILES_PER_DEGREE * np.cos(np.radians(widest)))
+
+        lat_cells = np.arange(self._cell(lat - lat_span), self._cell(lat + lat_span) + 1)
+        lon_cells = np.arange(self._cell(lon - lon_span), self._cell(lon + lon_span) + 1)
+        keys = self._cell_keys(lat_cells[:, None], lon_cells[None, :]).ravel()
+
+        starts = np.searchsorted(self.sorted_keys, keys, side='left')
+        ends = np.searchsorted(self.sorted_keys, keys, side='right')
+        lengths = ends - starts
+        if not lengths.sum():
+            return np.empty(0, dtype='int64')
+
+        # Concatenate every [start, end) range without a Python loop
+        offsets = np.repeat(starts - np.cumsum(lengths) + lengths, lengths)
+        return self.positions[offsets + np.arange(lengths.sum())]
+
+    def within(self, lat, lon, miles):
+        """Positions of points within `miles` of (lat, lon)."""
+        candidates = self.candidates(lat, lon, miles)
+        distances = haversine_miles(lat, lon, self.lat[candidates], self.lon[candidates])
+        return np.sort(candidates[distances <= miles])
+
+    def within_mask(self, lat, lon, miles):
+        """Boolean mask over all points, True for those within `miles` of (lat, lon)."""
+        mask = np.zeros(self.n_rows, dtype=bool)
+        mask[self.within(lat, lon, miles)] = True
+        return mask
+
+    def nearest(self, lat, lon, count=1):
+        """Positions of the `count` nearest points to (lat, lon), nearest first."""
+        miles = self.cell_degrees * _MILES_PER_DEGREE
+        total = len(self.positions)
+        while True:
+            candidates = self.candidates(lat, lon, miles)
+            # Only trust the search once enough points lie inside the circle itself
+            distances = haversine_miles(lat, lon, self.lat[candidates], self.lon[candidates])
+            inside = distances <= miles
+            if inside.sum() >= min(count, total) or len(candidates) == total:
+                order = np.argsort(distances, kind='stable')[:count]
+                return candidates[order]
+            miles *= 2